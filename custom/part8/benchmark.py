@@ -0,0 +1,676 @@
+"""Micro-benchmarks for the custom/part8 SPI.
+
+Usage:
+    python benchmark.py            # run every benchmark
+    python benchmark.py engines    # run only the selected ones
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import spi
+from spi import (
+    VM,
+    ClosureInterpreter,
+    Compiler,
+    IncrementalParser,
+    Interpreter,
+    Lexer,
+    Optimizer,
+    OutputSink,
+    Parser,
+    ProfilingInterpreter,
+    RegexLexer,
+    SemanticAnalyzer,
+    SourceCache,
+    Token,
+    TokenArray,
+    TokenType,
+    Tracer,
+)
+
+
+def best_of(func, repeat=5):
+    """Return the best wall time of `repeat` calls to func, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def checked_tree(text):
+    tree = Parser(Lexer(text)).parse()
+    SemanticAnalyzer().visit(tree)
+    return tree
+
+
+#region Engines
+def arithmetic_program(statements=40, depth=8):
+    """A procedure doing `statements` assignments, run 2**depth times."""
+    body = ';\n'.join(
+        f'   c := (a + {i}) * (b - {i}) DIV 3 + a * b - {i} * 2'
+        for i in range(statements)
+    )
+    return f"""
+program Arithmetic;
+procedure Work(n : integer);
+var a, b, c : integer;
+begin
+   a := n * 3 + 7;
+   b := a DIV 2 - n;
+{body};
+   if n > 0 then
+      Work(n - 1);
+      Work(n - 1)
+end;
+begin
+   Work({depth})
+end.
+"""
+
+
+def call_program(depth=12):
+    """Binary recursion with an almost empty body: 2**(depth+1) calls."""
+    return f"""
+program Calls;
+procedure Work(n : integer);
+begin
+   if n > 0 then
+      Work(n - 1);
+      Work(n - 1)
+end;
+begin
+   Work({depth})
+end.
+"""
+
+
+def bench_engines():
+    engines = (
+        ('tree walker', lambda tree: Interpreter(tree).interpret()),
+        ('bytecode VM', lambda tree: VM(Compiler().compile(tree)).run()),
+        ('closures', lambda tree: ClosureInterpreter(tree).interpret()),
+    )
+    for title, text in (
+        ('arithmetic-heavy', arithmetic_program()),
+        ('call-heavy', call_program()),
+    ):
+        tree = checked_tree(text)
+        print(title)
+        baseline = None
+        for name, run in engines:
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = best_of(lambda: run(tree), repeat=3)
+            baseline = baseline or seconds
+            print(f'   {name:<12} {seconds * 1000:9.1f} ms  x{baseline / seconds:.1f}')
+#endregion
+
+#region Lexers
+def large_program(lines=100_000):
+    """A generated program of roughly `lines` lines."""
+    statements = ';\n'.join(
+        f"   total := (total + {i}) * 3 DIV 2 - {i}.5;  {{ line {i} }}\n"
+        f"   if total <> {i} then WriteLn('total', total)"
+        for i in range(lines // 2)
+    )
+    return f"""
+program Large;
+var total : real;
+begin
+{statements}
+end.
+"""
+
+
+def count_tokens(lexer):
+    count = 0
+    while lexer.get_next_token().value is not None:
+        count += 1
+    return count
+
+
+def count_matches(text):
+    """What RegexLexer would cost if matching were all it did."""
+    count = -1
+    for count, _ in enumerate(RegexLexer.MASTER_PATTERN.finditer(text)):
+        pass
+    return count
+
+
+def bench_lexers():
+    """RegexLexer runs at about 2x the char Lexer here.
+
+    Not more: the master pattern's finditer() alone takes about a third
+    of its time, and making a Token per match most of the rest.
+    """
+    text = large_program()
+    print(f'{text.count(chr(10))} lines')
+    baseline = None
+    for name, lex in (
+        ('char', lambda: count_tokens(Lexer(text))),
+        ('regex', lambda: count_tokens(RegexLexer(text))),
+        ('finditer only', lambda: count_matches(text)),
+    ):
+        tokens = lex()
+        seconds = best_of(lex, repeat=3)
+        baseline = baseline or seconds
+        print(f'   {name:<13} {seconds * 1000:9.1f} ms  '
+              f'{tokens / seconds:12,.0f} tokens/s  x{baseline / seconds:.1f}')
+
+
+def peak_bytes(func):
+    """Peak memory allocated while func() runs."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def bench_stream_lexer():
+    def read_all(path):
+        with open(path) as f:
+            return count_tokens(RegexLexer(f.read()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.pas')
+        with open(path, 'w') as f:
+            f.write(large_program(200_000))
+        print(f'{os.path.getsize(path):,} bytes')
+        for name, lex in (
+            ('read() + regex', read_all),
+            ('Lexer.from_file', lambda path: count_tokens(Lexer.from_file(path))),
+        ):
+            seconds = best_of(lambda: lex(path), repeat=1)
+            peak = peak_bytes(lambda: lex(path))
+            print(f'   {name:<16} {seconds * 1000:9.1f} ms  peak {peak:>13,} bytes')
+#endregion
+
+#region Single-character tokens
+class EnumValueLookup:
+    """The single-character lookup the Lexer used to do: TokenType(char)."""
+    def get(self, char):
+        try:
+            return TokenType(char)
+        except ValueError:
+            return None
+
+
+def operator_dense_text(lines=20_000):
+    return 'x:=(a+b)*(c-d)/(e+f);y:=x<>(1,2).z>=w<=v<u;\n' * lines
+
+
+def bench_single_char():
+    text = operator_dense_text()
+    tokens = count_tokens(Lexer(text))
+    baseline = None
+    for name, table in (
+        ('TokenType(char)', EnumValueLookup()),
+        ('SINGLE_CHAR_TOKENS', spi.SINGLE_CHAR_TOKENS),
+    ):
+        saved, spi.SINGLE_CHAR_TOKENS = spi.SINGLE_CHAR_TOKENS, table
+        try:
+            seconds = best_of(lambda: count_tokens(Lexer(text)), repeat=3)
+        finally:
+            spi.SINGLE_CHAR_TOKENS = saved
+        baseline = baseline or seconds
+        print(f'   {name:<20} {tokens / seconds:12,.0f} tokens/s  x{baseline / seconds:.2f}')
+#endregion
+
+#region Token memory
+class DictToken:
+    """A Token the way it used to be: with a per-instance __dict__."""
+    def __init__(self, type, value, lineno=None, column=None):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.column = column
+
+
+def tokenize(lexer):
+    tokens = []
+    token = lexer.get_next_token()
+    while token.type != TokenType.EOF:
+        tokens.append(token)
+        token = lexer.get_next_token()
+    return tokens
+
+
+def allocated_bytes(build):
+    """Bytes still allocated by the object build() returns."""
+    tracemalloc.start()
+    try:
+        result = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def bench_token_memory():
+    text = large_program(20_000)
+    tokens, after = allocated_bytes(lambda: tokenize(Lexer(text)))
+    # the lexer used to build a new string for every name and keyword
+    names = {TokenType.ID, *spi.RESERVED_KEYWORDS.values()}
+    fresh = lambda token: (token.value + ' ')[:-1] if token.type in names else token.value
+    _, before = allocated_bytes(lambda: [
+        DictToken(t.type, fresh(t), t.lineno, t.column) for t in tokens
+    ])
+    count = len(tokens)
+    print(f'{count:,} tokens')
+    print(f'   {"__dict__ tokens":<20} {before / count:7.1f} bytes/token')
+    print(f'   {"slotted + interned":<20} {after / count:7.1f} bytes/token  '
+          f'x{before / after:.2f} smaller')
+#endregion
+
+#region Procedures program
+def procedures_program(procedures=2_000):
+    """Many small procedures, all called from the main block."""
+    declarations = '\n'.join(f"""
+procedure P{i}(a, b : integer);
+var x, y : integer;
+begin
+   x := (a + {i}) * (b - 3) DIV 2;
+   y := x * x - a * b + {i};
+   if x > y then WriteLn('P{i}', x) else WriteLn('P{i}', y)
+end;""" for i in range(procedures))
+    calls = ';\n'.join(f'   P{i}({i}, {i} + 1)' for i in range(procedures))
+    return f"""
+program Procedures;
+{declarations}
+begin
+{calls}
+end.
+"""
+
+
+def run_output(tree):
+    SemanticAnalyzer().visit(tree)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        Interpreter(tree).interpret()
+    return output.getvalue()
+#endregion
+
+#region Token array
+def bench_token_array():
+    text = procedures_program()
+    on_demand = best_of(lambda: Parser(RegexLexer(text)).parse(), repeat=3)
+    lexing = best_of(lambda: TokenArray.from_lexer(RegexLexer(text)), repeat=3)
+    tokens = TokenArray.from_lexer(RegexLexer(text))
+    parsing = best_of(lambda: Parser(tokens.cursor()).parse(), repeat=3)
+    print(f'{len(tokens):,} tokens')
+    print(f'   {"on demand":<12} lex + parse {on_demand * 1000:7.1f} ms')
+    print(f'   {"token array":<12} lex         {lexing * 1000:7.1f} ms')
+    print(f'   {"":<12} parse       {parsing * 1000:7.1f} ms')
+    _, objects = allocated_bytes(lambda: tokenize(RegexLexer(text)))
+    _, columns = allocated_bytes(lambda: TokenArray.from_lexer(RegexLexer(text)))
+    print(f'   {"Token list":<12} {objects:>12,} bytes')
+    print(f'   {"TokenArray":<12} {columns:>12,} bytes  x{objects / columns:.1f} smaller')
+#endregion
+
+#region AST cache
+def bench_ast_cache():
+    text = procedures_program()
+    with tempfile.TemporaryDirectory() as directory:
+        cache = SourceCache(directory)
+
+        def front_end():
+            tree = Parser(RegexLexer(text)).parse()
+            SemanticAnalyzer().visit(tree)
+            return tree
+
+        cache.store_tree(text, 'opt', front_end())
+        parsed = best_of(front_end, repeat=3)
+        loaded = best_of(lambda: cache.load_tree(text, 'opt'), repeat=3)
+        same = run_output(front_end()) == run_output(cache.load_tree(text, 'opt'))
+        print(f'   front end {parsed * 1000:7.1f} ms  '
+              f'cache hit {loaded * 1000:7.1f} ms  x{parsed / loaded:.1f} faster'
+              f'{"" if same else "  OUTPUT DIFFERS"}')
+#endregion
+
+#region Incremental parsing
+def bench_incremental():
+    text = procedures_program()
+    parser = IncrementalParser(text)
+    full = best_of(parser.parse, repeat=3)
+    print(f'{text.count(chr(10)):,} lines')
+    print(f'   {"full parse":<22} {full * 1000:8.2f} ms')
+    for name, anchor in (
+        ('edit a procedure', '   y := x * x - a * b + 1000;'),
+        ('edit a statement', '   P1000(1000, 1000 + 1)'),
+    ):
+        # retype the last digit of the anchor, back and forth
+        position = parser.text.index(anchor) + len(anchor) - 2
+        digits = iter('2121212121')
+        seconds = best_of(lambda: parser.edit(position, position + 1, next(digits)), repeat=10)
+        print(f'   {name:<22} {seconds * 1000:8.2f} ms  x{full / seconds:.0f} faster')
+    same = run_output(parser.tree) == run_output(Parser(RegexLexer(parser.text)).parse())
+    print(f'   {parser.unit_parses} unit parses, {parser.full_parses} full parses, '
+          f'{"same output" if same else "OUTPUT DIFFERS"}')
+#endregion
+
+#region Expression parser
+class RecursiveDescentParser(Parser):
+    """The Parser with its expression grammar the way it used to be:
+    one method per precedence level."""
+    def expr(self):
+        return self.relation()
+
+    def relation(self):
+        node = self.arithmetic_expr()
+        if self.current_token.type in (
+            TokenType.LESS_THAN,
+            TokenType.GREATER_THAN,
+            TokenType.LESS_EQUAL,
+            TokenType.GREATER_EQUAL,
+            TokenType.EQUAL,
+            TokenType.NOT_EQUAL,
+        ):
+            token = self.current_token
+            self.eat(token.type)
+            node = self.builder.BinOp(left=node, op=token, right=self.arithmetic_expr())
+        return node
+
+    def arithmetic_expr(self):
+        node = self.term()
+        while self.current_token.type in (TokenType.PLUS, TokenType.MINUS):
+            token = self.current_token
+            self.eat(token.type)
+            node = self.builder.BinOp(left=node, op=token, right=self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.current_token.type in (
+                TokenType.MUL,
+                TokenType.INTEGER_DIV,
+                TokenType.FLOAT_DIV,
+        ):
+            token = self.current_token
+            self.eat(token.type)
+            node = self.builder.BinOp(left=node, op=token, right=self.factor())
+        return node
+
+
+def dump(node):
+    """The shape of a tree, comparable with ==."""
+    fields = []
+    for name in spi._slot_names(type(node)):
+        value = getattr(node, name, None)
+        if isinstance(value, spi.AST):
+            value = dump(value)
+        elif isinstance(value, list):
+            value = [dump(item) if isinstance(item, spi.AST) else item for item in value]
+        elif isinstance(value, Token):
+            value = (value.type, value.value, value.lineno, value.column)
+        fields.append(value)
+    return type(node).__name__, fields
+
+
+def expression_program(expression, statements):
+    assignments = ';\n'.join(f'   x := {expression}' for _ in range(statements))
+    return f"""
+program Expressions;
+var x, a, b, c : integer;
+begin
+{assignments}
+end.
+"""
+
+
+def bench_expressions():
+    flat = ' + '.join(f'a * {i} - b DIV 3' for i in range(200))
+    nested = 'a'
+    for i in range(100):
+        nested = f'({nested} + {i}) * b'
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10_000))
+    try:
+        for name, text in (
+            ('long flat', expression_program(flat, 20)),
+            ('deeply nested', expression_program(nested, 40)),
+            ('short', expression_program('a + b * 2 < c', 2_000)),
+        ):
+            tokens = TokenArray.from_lexer(RegexLexer(text))
+            parser_classes = (RecursiveDescentParser, Parser)
+            # interleaved, so both see the same machine load
+            timings = [float('inf')] * len(parser_classes)
+            for _ in range(20):
+                for i, parser_class in enumerate(parser_classes):
+                    seconds = best_of(lambda: parser_class(tokens.cursor()).parse(), repeat=1)
+                    timings[i] = min(timings[i], seconds)
+            trees = [dump(parser_class(tokens.cursor()).parse()) for parser_class in parser_classes]
+            old, new = timings
+            print(f'   {name:<14} recursive descent {old * 1000:7.1f} ms  '
+                  f'precedence climbing {new * 1000:7.1f} ms  x{old / new:.2f}'
+                  f'{"" if trees[0] == trees[1] else "  TREES DIFFER"}')
+    finally:
+        sys.setrecursionlimit(limit)
+#endregion
+
+#region Constant folding
+def constant_program(statements=40, depth=8):
+    """Like arithmetic_program, but the expressions are all constant."""
+    body = ';\n'.join(
+        f'   c := (60 + {i}) * (24 - {i}) DIV 3 + 7 * 3.5 - {i} * 2'
+        for i in range(statements)
+    )
+    return f"""
+program Constants;
+procedure Work(n : integer);
+var c : real;
+begin
+{body};
+   if n > 0 then
+      Work(n - 1);
+      Work(n - 1)
+end;
+begin
+   Work({depth})
+end.
+"""
+
+
+def feature_flags_program(flags=30, depth=8):
+    """A generated configuration script: every setting behind a flag."""
+    settings = ';\n'.join(
+        f'   begin if {i % 3} = 0 then begin begin c := c + {i} end end '
+        f'else begin c := c - {i}; WriteLn(\'flag\', {i}) end end'
+        for i in range(flags)
+    )
+    return f"""
+program Flags;
+procedure Work(n : integer);
+var c : integer;
+begin
+   c := 0;
+{settings};
+   if n > 0 then
+      Work(n - 1);
+      Work(n - 1)
+end;
+begin
+   Work({depth})
+end.
+"""
+
+
+def bench_folding():
+    for title, text in (
+        ('constant expressions', constant_program()),
+        ('feature-flag branches', feature_flags_program()),
+    ):
+        print(title)
+        baseline = None
+        for name, optimize in (('--no-opt', False), ('optimized', True)):
+            tree = checked_tree(text)
+            optimizer = Optimizer()
+            if optimize:
+                tree = optimizer.optimize(tree)
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = best_of(lambda: Interpreter(tree).interpret(), repeat=3)
+            baseline = baseline or seconds
+            print(f'   {name:<10} {seconds * 1000:9.1f} ms  x{baseline / seconds:.1f}  '
+                  f'({optimizer.removed_nodes} nodes removed)')
+#endregion
+
+#region Output
+class PrintSink:
+    """Write the way the interpreters used to: one print() per value."""
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        print(text, end='', file=self.stream)
+
+    def write_values(self, values, new_line):
+        if values:
+            for value in values:
+                print(value, end=' ', file=self.stream)
+        else:
+            print(' ', end=' ', file=self.stream)
+        if new_line:
+            print(file=self.stream)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def report_program(rows=2_000):
+    """A report script: one WriteLn of several columns per row."""
+    lines = ';\n'.join(
+        f"   WriteLn('row', {i}, {i} * 3, {i} / 4, {i} > 1000, 'ok')"
+        for i in range(rows)
+    )
+    return f"""
+program Report;
+begin
+{lines}
+end.
+"""
+
+
+def bench_output():
+    tree = checked_tree(report_program())
+    # unbuffered, like writing to a pipe that is flushed on every write
+    with open(os.devnull, 'w') as devnull:
+        devnull.reconfigure(write_through=True)
+        baseline = None
+        for name, sink in (
+            ('print()', lambda: PrintSink(devnull)),
+            ('OutputSink', lambda: OutputSink(devnull)),
+        ):
+            seconds = best_of(lambda: Interpreter(tree, sink()).interpret(), repeat=3)
+            baseline = baseline or seconds
+            print(f'   {name:<12} {seconds * 1000:9.1f} ms  x{baseline / seconds:.1f}')
+#endregion
+
+#region Tracing
+class DiscardingTracer(Tracer):
+    """What disabled --stack tracing used to cost: the call stack was
+    formatted on every call, then thrown away."""
+    def log(self, msg):
+        pass
+
+
+def recursion_program(depth, repeat=20):
+    """Linear recursion `depth` calls deep, `repeat` times."""
+    calls = ';\n'.join(f'   Down({depth})' for _ in range(repeat))
+    return f"""
+program Recursion;
+procedure Down(n : integer);
+begin
+   if n > 0 then
+      Down(n - 1)
+end;
+begin
+{calls}
+end.
+"""
+
+
+def bench_tracing():
+    engines = (
+        ('tree walker', lambda tree, tracer: Interpreter(tree, tracer=tracer).interpret()),
+        ('bytecode VM', lambda tree, tracer: VM(Compiler().compile(tree), tracer=tracer).run()),
+    )
+    limit = sys.getrecursionlimit()
+    # the tree walker recurses through several Python frames per call
+    sys.setrecursionlimit(max(limit, 20_000))
+    try:
+        for depth in (100, 200, 400):
+            tree = checked_tree(recursion_program(depth))
+            calls = 20 * (depth + 1)
+            print(f'depth {depth}')
+            for name, run in engines:
+                timings = []
+                for tracer in (DiscardingTracer(), None):
+                    seconds = best_of(lambda: run(tree, tracer), repeat=3)
+                    timings.append(seconds / calls * 1e6)
+                eager, disabled = timings
+                print(f'   {name:<12} formatted {eager:7.2f} us/call  '
+                      f'disabled {disabled:5.2f} us/call  x{eager / disabled:.0f}')
+    finally:
+        sys.setrecursionlimit(limit)
+#endregion
+
+#region Profiler
+def bench_profiler():
+    for name, text in (
+        ('calls', call_program(12)),
+        ('arithmetic', arithmetic_program(depth=6)),
+    ):
+        tree = checked_tree(text)
+        plain = best_of(lambda: Interpreter(tree).interpret())
+        profiled = best_of(lambda: ProfilingInterpreter(tree).interpret())
+        print(f'   {name:<12} plain {plain * 1000:7.1f} ms  '
+              f'profiled {profiled * 1000:7.1f} ms  x{profiled / plain:.1f} slower')
+#endregion
+
+
+BENCHMARKS = {
+    'engines': bench_engines,
+    'lexers': bench_lexers,
+    'stream-lexer': bench_stream_lexer,
+    'single-char': bench_single_char,
+    'token-memory': bench_token_memory,
+    'token-array': bench_token_array,
+    'ast-cache': bench_ast_cache,
+    'incremental': bench_incremental,
+    'expressions': bench_expressions,
+    'folding': bench_folding,
+    'output': bench_output,
+    'tracing': bench_tracing,
+    'profiler': bench_profiler,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SPI micro-benchmarks')
+    parser.add_argument(
+        'names',
+        nargs='*',
+        help='Benchmarks to run: {} (default: all)'.format(', '.join(BENCHMARKS)),
+    )
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark: {name}')
+    for name in args.names or BENCHMARKS:
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
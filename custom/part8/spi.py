@@ -1,17 +1,39 @@
 """SPI - Simple Pascal Interpreter. Part 19"""
 
 import argparse
+import contextlib
+import gc
+import glob
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import marshal
+import operator
+import os
+import pickle
+import re
+import signal
+import socket
+import socketserver
+import stat
 import sys
-from enum import Enum
+import threading
+import time
+from array import array
+from enum import Enum, IntEnum
+from types import MappingProxyType
+
+__version__ = '0.8.0'
 
-_SHOULD_LOG_SCOPE = False  # see '--scope' command line option
-_SHOULD_LOG_STACK = False  # see '--stack' command line option
 
 #region Exception Classes
 class ErrorCode(Enum):
     UNEXPECTED_TOKEN = 'Unexpected token'
     ID_NOT_FOUND     = 'Identifier not found'
     DUPLICATE_ID     = 'Duplicate id found'
+    NOT_A_VARIABLE   = 'Not a variable'
 
 
 class Error(Exception):
@@ -82,8 +104,15 @@ class TokenType(Enum):
     NOT_EQUAL     = '<>'
     EOF           = 'EOF'    
 
+    # members are singletons compared by identity; Enum.__hash__ is
+    # Python code, which makes every dict keyed by TokenType slow
+    __hash__ = object.__hash__
+
 
 class Token:
+    # no per-instance __dict__, programs keep a lot of tokens alive
+    __slots__ = ('type', 'value', 'lineno', 'column')
+
     def __init__(self, type, value, lineno=None, column=None):
         self.type = type
         self.value = value
@@ -107,6 +136,10 @@ class Token:
     def __repr__(self):
         return self.__str__()
 
+    def __reduce__(self):
+        # smaller and faster to load than the default slot state
+        return Token, (self.type, self.value, self.lineno, self.column)
+
 
 def _build_reserved_keywords():
     """Build a dictionary of reserved keywords.
@@ -140,6 +173,29 @@ def _build_reserved_keywords():
 RESERVED_KEYWORDS = _build_reserved_keywords()
 
 
+def _build_single_char_tokens():
+    """Build a read-only mapping of single-character lexemes.
+
+    Looking a character up here replaces calling TokenType(char), which
+    goes through Enum's value lookup and raises ValueError for every
+    character that is not a token.
+
+    Result:
+        {'+': <TokenType.PLUS: '+'>,
+         '-': <TokenType.MINUS: '-'>,
+         ...
+         '=': <TokenType.EQUAL: '='>}
+    """
+    return MappingProxyType({
+        token_type.value: token_type
+        for token_type in TokenType
+        if len(token_type.value) == 1
+    })
+
+
+SINGLE_CHAR_TOKENS = _build_single_char_tokens()
+
+
 class Lexer:
     def __init__(self, text):
         # client string input, e.g. "4 + 2 * 3 - 6 / 2"
@@ -151,6 +207,36 @@ class Lexer:
         self.lineno = 1
         self.column = 1
 
+    @classmethod
+    def from_file(cls, path, chunk_size=None):
+        """Return a lexer that reads the file at path lazily, in chunks.
+
+        Only the chunk being scanned is held in memory, so files of any
+        size can be lexed. See StreamLexer.
+        """
+        stream = open(path, 'r', encoding='utf-8')
+        return StreamLexer(stream, chunk_size, close=True)
+
+    # lexers are context managers, so that code that may get a lexer
+    # from from_file() releases its file whether or not lexing finishes
+    def close(self):
+        """Release what the lexer holds, nothing for a string."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        """Yield the tokens up to, and not including, EOF."""
+        EOF = TokenType.EOF
+        while True:
+            token = self.get_next_token()
+            if token.type == EOF:
+                return
+            yield token
+
     def error(self):
         s = "Lexer error on '{lexeme}' line: {lineno} column: {column}".format(
             lexeme=self.current_char,
@@ -229,11 +315,12 @@ class Lexer:
         token_type = RESERVED_KEYWORDS.get(value.upper())
         if token_type is None:
             token.type = TokenType.ID
-            token.value = value
+            # every occurrence of a name shares one string object
+            token.value = sys.intern(value)
         else:
-            # reserved keyword
+            # reserved keyword, the value is the (shared) upper case name
             token.type = token_type
-            token.value = value.upper()
+            token.value = token_type.value
 
         return token
     
@@ -320,107 +407,505 @@ class Lexer:
                 self.advance() # eat the '>' character.
                 self.advance() # eat the '=' character.
                 return token
-            # single-character token
-            try:
-                # get enum member by value, e.g.
-                # TokenType(';') --> TokenType.SEMI
-                token_type = TokenType(self.current_char)
-            except ValueError:
-                # no enum member with value equal to self.current_char
+            # single-character token, e.g. ';' --> TokenType.SEMI
+            token_type = SINGLE_CHAR_TOKENS.get(self.current_char)
+            if token_type is None:
+                # no token type with value equal to self.current_char
                 self.error()
-            else:
-                # create a token with a single-character lexeme as its value
-                token = Token(
-                    type=token_type,
-                    value=token_type.value,  # e.g. ';', '.', etc
-                    lineno=self.lineno,
-                    column=self.column,
-                )
-                self.advance()
-                return token
+            # create a token with a single-character lexeme as its value
+            token = Token(
+                type=token_type,
+                value=self.current_char,  # e.g. ';', '.', etc
+                lineno=self.lineno,
+                column=self.column,
+            )
+            self.advance()
+            return token
 
         # EOF (end-of-file) token indicates that there is no more
         # input left for lexical analysis
         return Token(type=TokenType.EOF, value=None)
+
+
+# numbers of the groups of RegexLexer.MASTER_PATTERN, see match.lastindex
+_ID_GROUP, _NUMBER_GROUP, _STRING_GROUP, _COMPOSED_GROUP, _SINGLE_GROUP = range(1, 6)
+
+
+class RegexLexer(Lexer):
+    """Lexer driven by a single precompiled master regular expression.
+
+    Instead of advancing one character at a time it matches a whole
+    lexeme per step and slices it out of the text. The tokens, their
+    values and positions are the same as the ones Lexer produces.
+    """
+    # Every match is one token together with the whitespace and comments
+    # in front of it. At the end of the text only the skipped part matches.
+    MASTER_PATTERN = re.compile(r"""
+        (?:\s+|\{[^}]*\})*
+        (?:
+              (?P<ID>[^\W\d_][^\W_]*)
+            | (?P<NUMBER>\d+(?:\.\d*)?)
+            | (?P<STRING>'[^']*'?)
+            | (?P<COMPOSED>:=|<=|<>|>=)
+            | (?P<SINGLE>.)
+        )?
+    """, re.VERBOSE | re.DOTALL)
+
+    COMPOSED_TOKENS = MappingProxyType({
+        token_type.value: token_type
+        for token_type in (
+            TokenType.ASSIGN,
+            TokenType.LESS_EQUAL,
+            TokenType.NOT_EQUAL,
+            TokenType.GREATER_EQUAL,
+        )
+    })
+
+    # single and composed operators, the lexemes of the last two groups
+    OPERATOR_TOKENS = MappingProxyType({**SINGLE_CHAR_TOKENS, **COMPOSED_TOKENS})
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.current_char = text[0] if text else None
+        self.lineno = 1
+        self.column = 1
+        # tokens come straight from the generator, without a method call
+        self.get_next_token = self._scan().__next__
+
+    def _scan(self):
+        text = self.text
+        reserved_keywords = RESERVED_KEYWORDS
+        operators = self.OPERATOR_TOKENS
+        # enum attribute access is slow, look the members up once
+        ID = TokenType.ID
+        INTEGER_CONST = TokenType.INTEGER_CONST
+        REAL_CONST = TokenType.REAL_CONST
+        STRING = TokenType.STRING
+        count = text.count
+        rindex = text.rindex
+        intern = sys.intern
+        new = object.__new__
+        # type and value of every identifier spelling seen so far, so
+        # that keyword lookup and interning happen once per spelling
+        words = {}
+        lineno = 1
+        # index of the first character of the current line
+        line_start = 0
+        # end of the previous token
+        end = 0
+
+        for match in self.MASTER_PATTERN.finditer(text):
+            kind = match.lastindex
+            if kind is None:
+                # trailing whitespace and comments
+                break
+            start, token_end = match.span(kind)
+            newlines = count('\n', end, start)
+            if newlines:
+                lineno += newlines
+                line_start = rindex('\n', end, start) + 1
+            end = token_end
+
+            # filling the slots directly is about twice as fast as
+            # calling Token(), which matters at one token per match
+            token = new(Token)
+            token.lineno = lineno
+            token.column = start - line_start + 1
+            if kind == _ID_GROUP:
+                lexeme = text[start:end]
+                word = words.get(lexeme)
+                if word is None:
+                    token_type = reserved_keywords.get(lexeme.upper())
+                    if token_type is None:
+                        word = (ID, intern(lexeme))
+                    else:
+                        # reserved keyword
+                        word = (token_type, token_type._value_)
+                    words[lexeme] = word
+                token.type, token.value = word
+            elif kind >= _COMPOSED_GROUP:
+                token.value = lexeme = text[start:end]
+                token.type = token_type = operators.get(lexeme)
+                if token_type is None:
+                    self.current_char = lexeme
+                    self.lineno = lineno
+                    self.column = token.column
+                    self.error()
+            elif kind == _NUMBER_GROUP:
+                value = text[start:end]
+                if '.' in value:
+                    token.type = REAL_CONST
+                    token.value = float(value)
+                else:
+                    token.type = INTEGER_CONST
+                    token.value = int(value)
+            else:
+                closed = end - start > 1 and text[end - 1] == "'"
+                token.type = STRING
+                token.value = text[start + 1:end - 1 if closed else end]
+                # like Lexer.string, the position is the one after the quote
+                token.column += 1
+                newlines = count('\n', start, end)
+                if newlines:
+                    lineno += newlines
+                    line_start = rindex('\n', start, end) + 1
+            yield token
+
+        self.pos = len(text)
+        self.current_char = None
+        while True:
+            yield Token(type=TokenType.EOF, value=None)
+
+
+class StreamLexer(RegexLexer):
+    """RegexLexer over a file object, read chunk_size characters at a time.
+
+    A lexeme or comment cut by the end of a chunk is carried over and
+    scanned again once the next chunk is appended, so the tokens are
+    the ones RegexLexer produces for the whole text while memory stays
+    bounded by the chunk size (plus the longest comment or string).
+    """
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, stream, chunk_size=None, close=False):
+        self.stream = stream
+        self.chunk_size = self.CHUNK_SIZE if chunk_size is None else chunk_size
+        # the lexer owns the stream and closes it once it is exhausted,
+        # or on close(), see Lexer.from_file
+        self.owns_stream = close
+        super().__init__('')
+
+    def close(self):
+        if self.owns_stream:
+            self.stream.close()
+
+    def _read(self):
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.close()
+        return chunk
+
+    def _scan(self):
+        # RegexLexer._scan, plus carrying a lexeme cut by the end of a
+        # chunk over into the next one
+        text = self.text
+        # no more text follows the current chunk
+        final = False
+        reserved_keywords = RESERVED_KEYWORDS
+        single_char_tokens = SINGLE_CHAR_TOKENS
+        composed_tokens = self.COMPOSED_TOKENS
+        # enum attribute access is slow, look the members up once
+        ID = TokenType.ID
+        INTEGER_CONST = TokenType.INTEGER_CONST
+        REAL_CONST = TokenType.REAL_CONST
+        STRING = TokenType.STRING
+        count = text.count
+        intern = sys.intern
+        lineno = 1
+        # index of the first character of the current line
+        line_start = 0
+        # end of the previous token
+        end = 0
+
+        while True:
+            for match in self.MASTER_PATTERN.finditer(text, end):
+                kind = match.lastgroup
+                if not final and (
+                    match.end() == len(text)
+                    or kind == 'SINGLE' and text[match.start(kind)] == '{'
+                ):
+                    # the lexeme (or a comment) may go on in the next chunk
+                    break
+                if kind is None:
+                    # trailing whitespace and comments
+                    break
+
+                start, token_end = match.span(kind)
+                newlines = count('\n', end, start)
+                if newlines:
+                    lineno += newlines
+                    line_start = text.rindex('\n', end, start) + 1
+                end = token_end
+                column = start - line_start + 1
+
+                if kind == 'ID':
+                    value = text[start:end]
+                    token_type = reserved_keywords.get(value.upper())
+                    if token_type is None:
+                        yield Token(ID, intern(value), lineno, column)
+                    else:
+                        # reserved keyword
+                        yield Token(token_type, token_type._value_, lineno, column)
+                elif kind == 'SINGLE':
+                    lexeme = text[start]
+                    token_type = single_char_tokens.get(lexeme)
+                    if token_type is None:
+                        self.current_char = lexeme
+                        self.lineno = lineno
+                        self.column = column
+                        self.error()
+                    yield Token(token_type, lexeme, lineno, column)
+                elif kind == 'NUMBER':
+                    value = text[start:end]
+                    if '.' in value:
+                        yield Token(REAL_CONST, float(value), lineno, column)
+                    else:
+                        yield Token(INTEGER_CONST, int(value), lineno, column)
+                elif kind == 'COMPOSED':
+                    lexeme = text[start:end]
+                    yield Token(composed_tokens[lexeme], lexeme, lineno, column)
+                else:
+                    closed = end - start > 1 and text[end - 1] == "'"
+                    value = text[start + 1:end - 1 if closed else end]
+                    # like Lexer.string, the position is the one after the quote
+                    yield Token(STRING, value, lineno, column + 1)
+                    newlines = count('\n', start, end)
+                    if newlines:
+                        lineno += newlines
+                        line_start = text.rindex('\n', start, end) + 1
+
+            if final:
+                break
+            # carry the unfinished part over into the next chunk
+            chunk = self._read()
+            final = not chunk
+            text = text[end:] + chunk
+            count = text.count
+            line_start -= end
+            end = 0
+
+        self.pos = len(text)
+        self.current_char = None
+        while True:
+            yield Token(type=TokenType.EOF, value=None)
+
+
+_TOKEN_TYPES = tuple(TokenType)
+_TOKEN_TYPE_CODES = {token_type: code for code, token_type in enumerate(_TOKEN_TYPES)}
+
+
+class TokenArray:
+    """All the tokens of a source, lexed up front into `array` columns.
+
+    Token i is types[i] (the position of its type in TokenType),
+    constants[values[i]], linenos[i] and columns[i]; -1 stands for a
+    missing position. The last token is EOF. Values are stored once in
+    `constants`, so the array costs a few bytes per token instead of a
+    Token object. cursor() returns a token source for the Parser.
+    """
+    def __init__(self):
+        self.types = array('B')
+        self.values = array('i')
+        self.linenos = array('i')
+        self.columns = array('i')
+        self.constants = []
+        self._constant_index = {}
+
+    @classmethod
+    def from_lexer(cls, lexer):
+        tokens = cls()
+        append = tokens.append
+        EOF = TokenType.EOF
+        while True:
+            token = lexer.get_next_token()
+            append(token)
+            if token.type == EOF:
+                return tokens
+
+    def __len__(self):
+        return len(self.types)
+
+    def add_constant(self, value):
+        key = (type(value), value)
+        index = self._constant_index.get(key)
+        if index is None:
+            index = self._constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def append(self, token):
+        self.types.append(_TOKEN_TYPE_CODES[token.type])
+        self.values.append(self.add_constant(token.value))
+        self.linenos.append(-1 if token.lineno is None else token.lineno)
+        self.columns.append(-1 if token.column is None else token.column)
+
+    def token(self, index):
+        lineno = self.linenos[index]
+        column = self.columns[index]
+        return Token(
+            type=_TOKEN_TYPES[self.types[index]],
+            value=self.constants[self.values[index]],
+            lineno=None if lineno < 0 else lineno,
+            column=None if column < 0 else column,
+        )
+
+    def cursor(self):
+        return TokenCursor(self)
+
+    def memory_report(self):
+        h1 = 'TOKEN ARRAY MEMORY REPORT'
+        lines = [h1, '=' * len(h1), f'{"Column":<15} {"Items":>9} {"Bytes":>11}']
+        total = 0
+        for name in ('types', 'values', 'linenos', 'columns'):
+            column = getattr(self, name)
+            size = sys.getsizeof(column)
+            total += size
+            lines.append(f'{name:<15} {len(column):>9,} {size:>11,}')
+        size = sys.getsizeof(self.constants) + sum(map(sys.getsizeof, self.constants))
+        total += size
+        lines.append(f'{"constants":<15} {len(self.constants):>9,} {size:>11,}')
+        lines.append('-' * 37)
+        lines.append(f'{"Tokens":<15} {len(self):>9,}')
+        lines.append(f'{"Total":<15} {"":>9} {total:>11,}')
+        return '\n'.join(lines)
+
+
+class TokenCursor:
+    """A position in a TokenArray, used by the Parser like a lexer.
+
+    Besides get_next_token() it can look any number of tokens ahead and
+    go back to a marked position, both in constant time.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        # counts every token taken, also the repeated EOF past the end,
+        # so that a mark taken at the end goes back to the right token
+        self.pos = 0
+        # the position of EOF, returned for any position past it
+        self.last = len(tokens) - 1
+
+    def get_next_token(self):
+        pos = self.pos
+        self.pos = pos + 1
+        return self.tokens.token(pos if pos < self.last else self.last)
+
+    def lookahead(self, k=0):
+        """Return the token k positions after the next one, without moving."""
+        return self.tokens.token(min(self.pos + k, self.last))
+
+    def mark(self):
+        return self.pos
+
+    def reset(self, mark):
+        self.pos = mark
 #endregion
 
 #region AST Nodes Declaration
 class AST:
-    pass
+    # nodes declare every attribute in __slots__, no per-node __dict__
+    __slots__ = ()
 
 class BinOp(AST):
+    __slots__ = ('left', 'token', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
         self.right = right
 
 class Num(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
 
 class UnaryOp(AST):
+    __slots__ = ('token', 'op', 'expr')
+
     def __init__(self, op, expr):
         self.token = self.op = op
         self.expr = expr
 
 class Compound(AST):
     """Represents a 'BEGIN ... END' block"""
-    def __init__(self):
-        self.children = []
+    __slots__ = ('children',)
+
+    def __init__(self, children=None):
+        self.children = [] if children is None else children
 
 class Assign(AST):
+    __slots__ = ('left', 'token', 'op', 'right', 'depth', 'slot')
+
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
         self.right = right
+        # address of the assigned variable, set by SemanticAnalyzer
+        self.depth = None
+        self.slot = None
 
 class Var(AST):
     """The Var node is constructed out of ID token."""
+    __slots__ = ('token', 'value', 'depth', 'slot')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
+        # set by SemanticAnalyzer: how many static links to follow from
+        # the current activation record, and the index in that record
+        self.depth = None
+        self.slot = None
 
 class NoOp(AST):
-    pass
+    __slots__ = ()
 
 class String(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
 
 class Program(AST):
+    __slots__ = ('name', 'block', 'var_names')
+
     def __init__(self, name, block):
         self.name = name
         self.block = block
+        # names of the global variables in slot order, set by SemanticAnalyzer
+        self.var_names = None
 
 class Block(AST):
+    __slots__ = ('declarations', 'compound_statement')
+
     def __init__(self, declarations, compound_statement):
         self.declarations = declarations
         self.compound_statement = compound_statement
 
 class VarDecl(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
 
 class Type(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
 
 class Param(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
 
 class ProcedureDecl(AST):
+    __slots__ = ('proc_name', 'formal_params', 'block_node')
+
     def __init__(self, proc_name, formal_params, block_node):
         self.proc_name = proc_name
         self.formal_params = formal_params  # a list of Param nodes
         self.block_node = block_node
 
 class ProcedureCall(AST):
+    __slots__ = ('proc_name', 'actual_params', 'token', 'proc_symbol')
+
     def __init__(self, proc_name, actual_params, token):
         self.proc_name = proc_name
         self.actual_params = actual_params  # a list of AST nodes
@@ -429,32 +914,159 @@ class ProcedureCall(AST):
         self.proc_symbol = None
 
 class WriteStmt(AST):
-    def __init__(self):
+    __slots__ = ('new_line', 'expressions')
+
+    def __init__(self, new_line=False, expressions=None):
         # new_line will be used in the interpreter in order
         # to whether print in the same line or not.
-        self.new_line = False
+        self.new_line = new_line
         # array of expressions AST (see expr grammar)
-        self.expressions = []
+        self.expressions = [] if expressions is None else expressions
 
 class Boolean(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
-        self.value = token.value
+        self.value = token.type == TokenType.TRUE
 
 class IfStmt(AST):
-    def __init__(self, condition):
+    __slots__ = ('condition', 'consequences', 'alternatives')
+
+    def __init__(self, condition, consequences=None, alternatives=None):
         self.condition = condition
-        self.consequences = [] # list of statements
-        self.alternatives = [] # list of statements
+        # lists of statements
+        self.consequences = [] if consequences is None else consequences
+        self.alternatives = [] if alternatives is None else alternatives
+
+
+def _slot_names(node_class):
+    names = []
+    for klass in reversed(node_class.__mro__):
+        for name in getattr(klass, '__slots__', ()):
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def iter_child_nodes(node):
+    """Yield the direct child nodes of node, in attribute order."""
+    for name in _slot_names(type(node)):
+        value = getattr(node, name, None)
+        if isinstance(value, AST):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, AST):
+                    yield item
+
+
+def ast_memory_report(tree):
+    """Return a table of node counts and bytes used by the tree.
+
+    Nodes, the lists holding their children and the tokens they keep
+    are each counted once, even when shared (e.g. BinOp.op and
+    BinOp.token).
+    """
+    counts = {}
+    sizes = {}
+    seen = set()
+    lists = [0, 0]
+    tokens = [0, 0]
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        name = type(node).__name__
+        counts[name] = counts.get(name, 0) + 1
+        sizes[name] = sizes.get(name, 0) + sys.getsizeof(node)
+
+        for slot in _slot_names(type(node)):
+            value = getattr(node, slot, None)
+            if isinstance(value, AST):
+                stack.append(value)
+            elif isinstance(value, list) and id(value) not in seen:
+                seen.add(id(value))
+                lists[0] += 1
+                lists[1] += sys.getsizeof(value)
+                stack.extend(item for item in value if isinstance(item, AST))
+            elif isinstance(value, Token) and id(value) not in seen:
+                seen.add(id(value))
+                tokens[0] += 1
+                tokens[1] += sys.getsizeof(value)
+
+    h1 = 'AST MEMORY REPORT'
+    lines = [h1, '=' * len(h1), f'{"Node type":<15} {"Count":>9} {"Bytes":>11}']
+    for name in sorted(counts, key=sizes.get, reverse=True):
+        lines.append(f'{name:<15} {counts[name]:>9,} {sizes[name]:>11,}')
+    lines.append('-' * 37)
+    total_nodes = sum(counts.values())
+    total_bytes = sum(sizes.values())
+    lines.append(f'{"Nodes":<15} {total_nodes:>9,} {total_bytes:>11,}')
+    lines.append(f'{"Child lists":<15} {lists[0]:>9,} {lists[1]:>11,}')
+    lines.append(f'{"Tokens":<15} {tokens[0]:>9,} {tokens[1]:>11,}')
+    lines.append(f'{"Total":<15} {"":>9} {total_bytes + lists[1] + tokens[1]:>11,}')
+    return '\n'.join(lines)
 #endregion
 
 #region Paraser Class
 ###############################################################################
 #  PARSER                                                                     #
 ###############################################################################
+RELATIONAL_POWER = 1
+
+
+class TreeBuilder:
+    """Parser output: a tree of AST objects.
+
+    The parser creates every node through its builder, so another
+    builder can store the same tree differently.
+    """
+    BinOp = BinOp
+    Num = Num
+    UnaryOp = UnaryOp
+    Compound = Compound
+    Assign = Assign
+    Var = Var
+    NoOp = NoOp
+    String = String
+    Program = Program
+    Block = Block
+    VarDecl = VarDecl
+    Type = Type
+    Param = Param
+    ProcedureDecl = ProcedureDecl
+    ProcedureCall = ProcedureCall
+    WriteStmt = WriteStmt
+    Boolean = Boolean
+    IfStmt = IfStmt
+
+    def finish(self, root):
+        return root
+
+
 class Parser:
-    def __init__(self, lexer):
+    # how tightly binary operators bind their operands, see expr()
+    BINDING_POWERS = MappingProxyType({
+        TokenType.LESS_THAN: RELATIONAL_POWER,
+        TokenType.GREATER_THAN: RELATIONAL_POWER,
+        TokenType.LESS_EQUAL: RELATIONAL_POWER,
+        TokenType.GREATER_EQUAL: RELATIONAL_POWER,
+        TokenType.EQUAL: RELATIONAL_POWER,
+        TokenType.NOT_EQUAL: RELATIONAL_POWER,
+        TokenType.PLUS: 2,
+        TokenType.MINUS: 2,
+        TokenType.MUL: 3,
+        TokenType.INTEGER_DIV: 3,
+        TokenType.FLOAT_DIV: 3,
+    })
+
+    def __init__(self, lexer, builder=None):
         self.lexer = lexer
+        self.builder = TreeBuilder() if builder is None else builder
         # set current token to the first token taken from the input
         self.current_token = self.lexer.get_next_token()
         self.next_token = self.lexer.get_next_token()
@@ -464,6 +1076,28 @@ class Parser:
         self.next_token = self.lexer.get_next_token()
         return current_token
 
+    def peek(self, k=1):
+        """Return the token k positions ahead, peek(0) is current_token.
+
+        Looking further than next_token needs a TokenCursor as input.
+        """
+        if k == 0:
+            return self.current_token
+        if k == 1:
+            return self.next_token
+        return self.lexer.lookahead(k - 2)
+
+    def mark(self):
+        """Return the current position, for reset() (TokenCursor input only)."""
+        # current_token and next_token were already taken from the cursor
+        return self.lexer.mark() - 2
+
+    def reset(self, mark):
+        """Go back to a position returned by mark(), to backtrack."""
+        self.lexer.reset(mark)
+        self.current_token = self.lexer.get_next_token()
+        self.next_token = self.lexer.get_next_token()
+
     def error(self, error_code, token):
         raise ParserError(
             error_code=error_code,
@@ -487,11 +1121,11 @@ class Parser:
     def program(self):
         """program : PROGRAM variable SEMI block DOT"""
         self.eat(TokenType.PROGRAM)
-        var_node = self.variable()
-        prog_name = var_node.value
+        prog_name = self.current_token.value
+        self.eat(TokenType.ID)
         self.eat(TokenType.SEMI)
         block_node = self.block()
-        program_node = Program(prog_name, block_node)
+        program_node = self.builder.Program(prog_name, block_node)
         self.eat(TokenType.DOT)
         return program_node
 
@@ -499,7 +1133,7 @@ class Parser:
         """block : declarations compound_statement"""
         declaration_nodes = self.declarations()
         compound_statement_node = self.compound_statement()
-        node = Block(declaration_nodes, compound_statement_node)
+        node = self.builder.Block(declaration_nodes, compound_statement_node)
         return node
 
     def declarations(self):
@@ -535,8 +1169,9 @@ class Parser:
         self.eat(TokenType.COLON)
         type_node = self.type_spec()
 
+        builder = self.builder
         for param_token in param_tokens:
-            param_node = Param(Var(param_token), type_node)
+            param_node = builder.Param(builder.Var(param_token), type_node)
             param_nodes.append(param_node)
 
         return param_nodes
@@ -559,19 +1194,19 @@ class Parser:
 
     def variable_declaration(self):
         """variable_declaration : ID (COMMA ID)* COLON type_spec"""
-        var_nodes = [Var(self.current_token)]  # first ID
+        var_nodes = [self.builder.Var(self.current_token)]  # first ID
         self.eat(TokenType.ID)
 
         while self.current_token.type == TokenType.COMMA:
             self.eat(TokenType.COMMA)
-            var_nodes.append(Var(self.current_token))
+            var_nodes.append(self.builder.Var(self.current_token))
             self.eat(TokenType.ID)
 
         self.eat(TokenType.COLON)
 
         type_node = self.type_spec()
         var_declarations = [
-            VarDecl(var_node, type_node)
+            self.builder.VarDecl(var_node, type_node)
             for var_node in var_nodes
         ]
         return var_declarations
@@ -592,7 +1227,7 @@ class Parser:
 
         self.eat(TokenType.SEMI)
         block_node = self.block()
-        proc_decl = ProcedureDecl(proc_name, formal_params, block_node)
+        proc_decl = self.builder.ProcedureDecl(proc_name, formal_params, block_node)
         self.eat(TokenType.SEMI)
         return proc_decl
 
@@ -609,7 +1244,7 @@ class Parser:
         elif self.current_token.type == TokenType.BOOLEAN:
             self.eat(TokenType.BOOLEAN)
 
-        node = Type(token)
+        node = self.builder.Type(token)
         return node
 
     def compound_statement(self):
@@ -620,10 +1255,7 @@ class Parser:
         nodes = self.statement_list()
         self.eat(TokenType.END)
 
-        root = Compound()
-        for node in nodes:
-            root.children.append(node)
-
+        root = self.builder.Compound(nodes)
         return root
 
     def statement_list(self):
@@ -696,7 +1328,7 @@ class Parser:
 
         self.eat(TokenType.RPAREN)
 
-        node = ProcedureCall(
+        node = self.builder.ProcedureCall(
             proc_name=proc_name,
             actual_params=actual_params,
             token=token,
@@ -711,14 +1343,14 @@ class Parser:
         token = self.current_token
         self.eat(TokenType.ASSIGN)
         right = self.expr()
-        node = Assign(left, token, right)
+        node = self.builder.Assign(left, token, right)
         return node
 
     def variable(self):
         """
         variable : ID
         """
-        node = Var(self.current_token)
+        node = self.builder.Var(self.current_token)
         self.eat(TokenType.ID)
         return node
     
@@ -726,15 +1358,15 @@ class Parser:
         """
         write_statement : WRITE | WRITELN (LPAREN (expr (SEMI expr)*)? RPAREN)?
         """        
-        node = WriteStmt()
-        
+        new_line = False
+
         # pretty straightforward, we just eat the right TokenType
         # and set the new_line node's property given that case.
         if self.current_token.type == TokenType.WRITE:
             self.eat(TokenType.WRITE)            
         elif self.current_token.type == TokenType.WRITELN:
             self.eat(TokenType.WRITELN)
-            node.new_line = True
+            new_line = True
         
         # Create the expressions array.
         expressions = []
@@ -751,10 +1383,7 @@ class Parser:
             # eat the closing parenthesis.
             self.eat(TokenType.RPAREN)
         
-        # fill the expressions array
-        for expression in expressions:
-            node.expressions.append(expression)
-
+        node = self.builder.WriteStmt(new_line, expressions)
         return node
 
     def if_statement(self):
@@ -775,16 +1404,11 @@ class Parser:
         elif self.current_token.type == TokenType.ELSE:
             alternatives.extend(self.else_statement())
 
-        node = IfStmt(condition=condition)
-        
-        # fill all consequences nodes.
-        for consequence in consequences:
-            node.consequences.append(consequence)
-
-        # fill all alternatives nodes.
-        for alternative in alternatives:
-            node.alternatives.append(alternative)
-        
+        node = self.builder.IfStmt(
+            condition=condition,
+            consequences=consequences,
+            alternatives=alternatives,
+        )
         return node
 
     def else_statement(self):
@@ -803,83 +1427,38 @@ class Parser:
 
     def empty(self):
         """An empty production"""
-        return NoOp()
+        return self.builder.NoOp()
 
     def expr(self):
-        return self.relation()
-
-    def relation(self):
         """
-        relation : arithmetic_expr (rel_op arithmetic_expr)?
-        rel_op   : LESS_THAN
-                 | GREATER_THAN
-                 | EQUAL
-                 | LESS_EQUAL
-                 | GREATER_EQUAL
-                 | NOT_EQUAL
-        """          
-        node = self.arithmetic_expr()
-        if self.current_token.type in (
-            TokenType.LESS_THAN,
-            TokenType.GREATER_THAN,
-            TokenType.LESS_EQUAL,
-            TokenType.GREATER_EQUAL,
-            TokenType.EQUAL,
-            TokenType.NOT_EQUAL,
-        ):
-            token = self.current_token
-            if self.current_token.type == TokenType.LESS_THAN:
-                self.eat(TokenType.LESS_THAN)            
-            elif self.current_token.type == TokenType.GREATER_THAN:
-                self.eat(TokenType.GREATER_THAN)            
-            elif self.current_token.type == TokenType.EQUAL:
-                self.eat(TokenType.EQUAL)            
-            elif self.current_token.type == TokenType.LESS_EQUAL:
-                self.eat(TokenType.LESS_EQUAL)            
-            elif self.current_token.type == TokenType.GREATER_EQUAL:
-                self.eat(TokenType.GREATER_EQUAL)            
-            elif self.current_token.type == TokenType.NOT_EQUAL:
-                self.eat(TokenType.NOT_EQUAL)
-            node = BinOp(left=node, op=token, right=self.arithmetic_expr())
-        return node
+        expr : factor (binary_op factor)*
 
-    def arithmetic_expr(self):
+        Precedence climbing: an operator takes the operands that bind
+        tighter than it (see BINDING_POWERS), equal ones group to the
+        left, and a relational operator cannot follow another one
+        without parentheses.
         """
-        arithmetic_expr : term ((PLUS | MINUS) term)*
-        """
-        node = self.term()
-
-        while self.current_token.type in (TokenType.PLUS, TokenType.MINUS):
-            token = self.current_token
-            if token.type == TokenType.PLUS:
-                self.eat(TokenType.PLUS)
-            elif token.type == TokenType.MINUS:
-                self.eat(TokenType.MINUS)
-
-            node = BinOp(left=node, op=token, right=self.term())
-
-        return node
-
-    def term(self):
-        """term : factor ((MUL | INTEGER_DIV | FLOAT_DIV) factor)*"""
-        node = self.factor()
-
-        while self.current_token.type in (
-                TokenType.MUL,
-                TokenType.INTEGER_DIV,
-                TokenType.FLOAT_DIV,
-        ):
+        return self.climb(self.factor(), 0)
+
+    def climb(self, node, min_power):
+        """Extend node, the left operand, with the operators binding
+        tighter than min_power and their right operands."""
+        power_of = self.BINDING_POWERS.get
+        BinOp = self.builder.BinOp
+        while True:
             token = self.current_token
-            if token.type == TokenType.MUL:
-                self.eat(TokenType.MUL)
-            elif token.type == TokenType.INTEGER_DIV:
-                self.eat(TokenType.INTEGER_DIV)
-            elif token.type == TokenType.FLOAT_DIV:
-                self.eat(TokenType.FLOAT_DIV)
-
-            node = BinOp(left=node, op=token, right=self.factor())
-
-        return node
+            power = power_of(token.type, 0)
+            if power <= min_power:
+                return node
+            # the operator type was just checked, no need for eat()
+            self.current_token = self.get_next_token()
+            right = self.factor()
+            if power_of(self.current_token.type, 0) > power:
+                right = self.climb(right, power)
+            node = BinOp(left=node, op=token, right=right)
+            if power == RELATIONAL_POWER:
+                # relational operators do not associate
+                min_power = power
 
     def factor(self):
         """factor : PLUS factor
@@ -892,18 +1471,18 @@ class Parser:
         token = self.current_token
         if token.type == TokenType.PLUS:
             self.eat(TokenType.PLUS)
-            node = UnaryOp(token, self.factor())
+            node = self.builder.UnaryOp(token, self.factor())
             return node
         elif token.type == TokenType.MINUS:
             self.eat(TokenType.MINUS)
-            node = UnaryOp(token, self.factor())
+            node = self.builder.UnaryOp(token, self.factor())
             return node
         elif token.type == TokenType.INTEGER_CONST:
             self.eat(TokenType.INTEGER_CONST)
-            return Num(token)
+            return self.builder.Num(token)
         elif token.type == TokenType.REAL_CONST:
             self.eat(TokenType.REAL_CONST)
-            return Num(token)
+            return self.builder.Num(token)
         elif token.type == TokenType.LPAREN:
             self.eat(TokenType.LPAREN)
             node = self.expr()
@@ -912,13 +1491,13 @@ class Parser:
         elif token.type == TokenType.STRING:
             # Nothing new here, just eat the STRING token and return the String() AST.
             self.eat(TokenType.STRING)
-            return String(token)
+            return self.builder.String(token)
         elif token.type in (TokenType.TRUE, TokenType.FALSE):
             if token.type == TokenType.TRUE:
                 self.eat(TokenType.TRUE)
             elif token.type == TokenType.FALSE:
                 self.eat(TokenType.FALSE)
-            return Boolean(token)
+            return self.builder.Boolean(token)
         else:
             node = self.variable()
             return node
@@ -959,9 +1538,12 @@ class Parser:
 
         empty :
 
-        expr : term ((PLUS | MINUS) term)*
+        expr : factor (binary_op factor)*
 
-        term : factor ((MUL | INTEGER_DIV | FLOAT_DIV) factor)*
+        binary_op : rel_op
+                  | PLUS | MINUS
+                  | MUL | INTEGER_DIV | FLOAT_DIV
+                  (loosest to tightest, see BINDING_POWERS)
 
         factor : PLUS factor
                | MINUS factor
@@ -979,7 +1561,7 @@ class Parser:
                 token=self.current_token,
             )
 
-        return node
+        return self.builder.finish(node)
 #endregion
 
 #region Visitor Interface
@@ -987,15 +1569,207 @@ class Parser:
 #  AST visitors (walkers)                                                     #
 ###############################################################################
 class NodeVisitor:
+    # node class -> visit_* function, every subclass gets its own table
+    _dispatch_table = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch_table = {}
+
     def visit(self, node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
+        try:
+            visitor = self._dispatch_table[node.__class__]
+        except KeyError:
+            visitor = self._resolve_visitor(node.__class__)
+        return visitor(self, node)
+
+    @classmethod
+    def _resolve_visitor(cls, node_class):
+        """Find the visit_* method for node_class once per visitor class.
+
+        The lookup goes through the class, so visit_* methods overridden
+        in a subclass are picked up by that subclass' table.
+        """
+        method_name = 'visit_' + node_class.__name__
+        visitor = getattr(cls, method_name, cls.generic_visit)
+        cls._dispatch_table[node_class] = visitor
+        return visitor
 
     def generic_visit(self, node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
 #endregion
 
+#region Output and Tracing
+###############################################################################
+#  OUTPUT AND TRACING                                                         #
+###############################################################################
+class OutputSink:
+    """Buffered destination of Write and WriteLn.
+
+    Text is collected in memory and handed to the stream in one write
+    once buffer_size characters are pending, and on flush(). Every
+    engine flushes when the program ends, normally or with an error.
+    Use capture() to keep the output in memory instead, e.g. when
+    embedding the interpreter.
+    """
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE):
+        self.stream = sys.stdout if stream is None else stream
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    @classmethod
+    def capture(cls):
+        """Return a sink whose output is read back with getvalue()."""
+        return cls(io.StringIO())
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def write_values(self, values, new_line):
+        """Write the values of a Write (or WriteLn) statement."""
+        if values:
+            text = ' '.join(map(str, values)) + ' '
+        else:
+            # print blank like Pascal does.
+            text = '  '
+        if new_line:
+            text += '\n'
+        self.write(text)
+
+    def flush(self):
+        if self._parts:
+            self.stream.write(''.join(self._parts))
+            self._parts.clear()
+            self._size = 0
+        self.stream.flush()
+
+    def getvalue(self):
+        """Return everything written so far (capture() sinks only)."""
+        self.flush()
+        return self.stream.getvalue()
+
+
+class Tracer:
+    """Receives the events printed by --scope, --stack and --opt-stats.
+
+    Components take a `tracer` argument that is None when tracing is
+    off, and only build an event's text when they have a tracer, so
+    disabled tracing costs an `is None` test per event. Events are
+    written to an OutputSink, usually the one the program writes to,
+    so that they stay in order with the program output.
+    """
+    def __init__(self, output=None):
+        self.output = OutputSink() if output is None else output
+
+    def log(self, msg):
+        self.output.write(f'{msg}\n')
+
+    def enter(self, ar, call_stack):
+        """ar was pushed onto call_stack."""
+        self.log(f'ENTER: {ar.type.value} {ar.name}')
+        self.log(str(call_stack))
+
+    def leave(self, ar, call_stack):
+        """ar is about to be popped off call_stack."""
+        self.log(f'LEAVE: {ar.type.value} {ar.name}')
+        self.log(str(call_stack))
+
+
+class Profiler:
+    """Where a run spent its time, collected by ProfilingInterpreter.
+
+    For every procedure (and the program itself): the number of calls,
+    the inclusive time, spent until the call returned, and the
+    exclusive time, without the procedures it called. Procedures are
+    named with their enclosing procedures (e.g. 'Alpha.Helper'), so
+    nested procedures of the same name stay apart. A recursive
+    procedure's inclusive time is counted for its outermost call only,
+    like cProfile does. Also the number of visits per AST node type and
+    the exclusive time per call stack, for flame graphs.
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # name -> [calls, inclusive seconds, exclusive seconds]
+        self.procedures = {}
+        # node class name -> visits
+        self.node_counts = {}
+        # 'Main;Alpha;Beta' -> exclusive seconds
+        self.stacks = {}
+        # [name, stack, start, seconds spent in callees] per active call
+        self._frames = []
+        # name -> active calls, to spot recursion
+        self._active = {}
+
+    def enter(self, name):
+        frames = self._frames
+        stack = f'{frames[-1][1]};{name}' if frames else name
+        self._active[name] = self._active.get(name, 0) + 1
+        frames.append([name, stack, self.clock(), 0.0])
+
+    def leave(self):
+        name, stack, start, callees = self._frames.pop()
+        elapsed = self.clock() - start
+        exclusive = elapsed - callees
+        stats = self.procedures.get(name)
+        if stats is None:
+            stats = self.procedures[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[2] += exclusive
+        self._active[name] -= 1
+        if not self._active[name]:
+            stats[1] += elapsed
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + exclusive
+        if self._frames:
+            self._frames[-1][3] += elapsed
+
+    def report(self):
+        h1 = 'PROFILE'
+        lines = [h1, '=' * len(h1)]
+        lines.append(
+            f'{"Procedure":<20} {"Calls":>9} {"Inclusive ms":>13} '
+            f'{"Exclusive ms":>13} {"Per call ms":>12}'
+        )
+        for name, (calls, inclusive, exclusive) in sorted(
+            self.procedures.items(), key=lambda item: item[1][2], reverse=True,
+        ):
+            lines.append(
+                f'{name:<20} {calls:>9,} {inclusive * 1000:>13.3f} '
+                f'{exclusive * 1000:>13.3f} {exclusive * 1000 / calls:>12.4f}'
+            )
+        lines.append('-' * 71)
+        lines.append(f'{"Node type":<20} {"Visits":>9}')
+        for name, count in sorted(self.node_counts.items(), key=lambda item: item[1], reverse=True):
+            lines.append(f'{name:<20} {count:>9,}')
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return json.dumps({
+            'procedures': {
+                name: {
+                    'calls': calls,
+                    'inclusive_seconds': inclusive,
+                    'exclusive_seconds': exclusive,
+                }
+                for name, (calls, inclusive, exclusive) in self.procedures.items()
+            },
+            'node_counts': self.node_counts,
+        }, indent=2)
+
+    def to_collapsed(self):
+        """Return the stacks as flamegraph.pl and speedscope read them:
+        one `Main;Alpha;Beta <microseconds>` line per call stack."""
+        return ''.join(
+            f'{stack} {round(seconds * 1_000_000)}\n'
+            for stack, seconds in self.stacks.items()
+        )
+#endregion
+
 #region Symbol Classes
 ###############################################################################
 #  SYMBOLS, TABLES, SEMANTIC ANALYSIS                                         #
@@ -1009,6 +1783,8 @@ class Symbol:
 class VarSymbol(Symbol):
     def __init__(self, name, type):
         super().__init__(name, type)
+        # index in the activation record, set when inserted into a scope
+        self.slot = None
 
     def __str__(self):
         return "<{class_name}(name='{name}', type='{type}')>".format(
@@ -1039,6 +1815,10 @@ class ProcedureSymbol(Symbol):
         self.formal_params = [] if formal_params is None else formal_params
         # a reference to procedure's body (AST sub-tree)
         self.block_ast = None
+        # names of the parameters and local variables in slot order
+        self.var_names = []
+        # the name with those of the enclosing procedures, e.g. 'Alpha.Beta'
+        self.qualified_name = name
 
     def __str__(self):
         return '<{class_name}(name={name}, parameters={params})>'.format(
@@ -1052,11 +1832,14 @@ class ProcedureSymbol(Symbol):
 
 #region Symbol Table
 class ScopedSymbolTable:
-    def __init__(self, scope_name, scope_level, enclosing_scope=None):
+    def __init__(self, scope_name, scope_level, enclosing_scope=None, tracer=None):
         self._symbols = {}
+        # names of the variables declared in this scope, in slot order
+        self.var_names = []
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
+        self.tracer = tracer
 
     def _init_builtins(self):
         self.insert(BuiltinTypeSymbol('INTEGER'))
@@ -1086,39 +1869,42 @@ class ScopedSymbolTable:
 
     __repr__ = __str__
 
-    def log(self, msg):
-        if _SHOULD_LOG_SCOPE:
-            print(msg)
-
     def insert(self, symbol):
-        self.log(f'Insert: {symbol.name}')
+        if self.tracer is not None:
+            self.tracer.log(f'Insert: {symbol.name}')
         symbol.scope_level = self.scope_level
+        if isinstance(symbol, VarSymbol):
+            symbol.slot = len(self.var_names)
+            self.var_names.append(symbol.name)
         self._symbols[symbol.name] = symbol
 
     def lookup(self, name, current_scope_only=False):
-        self.log(f'Lookup: {name}. (Scope name: {self.scope_name})')
-        # 'symbol' is either an instance of the Symbol class or None
-        symbol = self._symbols.get(name)
-
-        if symbol is not None:
-            return symbol
-
-        if current_scope_only:
-            return None
-
-        # recursively go up the chain and lookup the name
-        if self.enclosing_scope is not None:
-            return self.enclosing_scope.lookup(name)
+        scope = self
+        while scope is not None:
+            if scope.tracer is not None:
+                scope.tracer.log(f'Lookup: {name}. (Scope name: {scope.scope_name})')
+            # 'symbol' is either an instance of the Symbol class or None
+            symbol = scope._symbols.get(name)
+            if symbol is not None or current_scope_only:
+                return symbol
+            # go up the chain and lookup the name
+            scope = scope.enclosing_scope
+        return None
 #endregion
 
 #region SemanticAnalyzer Class
 class SemanticAnalyzer(NodeVisitor):
-    def __init__(self):
+    def __init__(self, tracer=None):
         self.current_scope = None
+        # the scope of the last Program visited, with all its declarations
+        self.global_scope = None
+        self.tracer = tracer
+        # the ProcedureSymbol of the procedure being visited
+        self.current_procedure = None
 
     def log(self, msg):
-        if _SHOULD_LOG_SCOPE:
-            print(msg)
+        if self.tracer is not None:
+            self.tracer.log(msg)
 
     def error(self, error_code, token):
         raise SemanticError(
@@ -1138,12 +1924,15 @@ class SemanticAnalyzer(NodeVisitor):
             scope_name='global',
             scope_level=1,
             enclosing_scope=self.current_scope,  # None
+            tracer=self.tracer,
         )
         global_scope._init_builtins()
         self.current_scope = global_scope
 
         # visit subtree
         self.visit(node.block)
+        node.var_names = global_scope.var_names
+        self.global_scope = global_scope
 
         self.log(global_scope)
 
@@ -1182,13 +1971,18 @@ class SemanticAnalyzer(NodeVisitor):
         proc_name = node.proc_name
         proc_symbol = ProcedureSymbol(proc_name)
         self.current_scope.insert(proc_symbol)
+        enclosing_procedure = self.current_procedure
+        if enclosing_procedure is not None:
+            proc_symbol.qualified_name = f'{enclosing_procedure.qualified_name}.{proc_name}'
+        self.current_procedure = proc_symbol
 
         self.log(f'ENTER scope: {proc_name}')
         # Scope for parameters and local variables
         procedure_scope = ScopedSymbolTable(
             scope_name=proc_name,
             scope_level=self.current_scope.scope_level + 1,
-            enclosing_scope=self.current_scope
+            enclosing_scope=self.current_scope,
+            tracer=self.tracer,
         )
         self.current_scope = procedure_scope
 
@@ -1205,10 +1999,12 @@ class SemanticAnalyzer(NodeVisitor):
         self.log(procedure_scope)
 
         self.current_scope = self.current_scope.enclosing_scope
+        self.current_procedure = enclosing_procedure
         self.log(f'LEAVE scope: {proc_name}')
 
         # accessed by the interpreter when executing procedure call
         proc_symbol.block_ast = node.block_node
+        proc_symbol.var_names = procedure_scope.var_names
 
     def visit_VarDecl(self, node):
         type_name = node.type_node.value
@@ -1234,12 +2030,23 @@ class SemanticAnalyzer(NodeVisitor):
         self.visit(node.right)
         # left-hand side
         self.visit(node.left)
+        if node.left.slot is None:
+            # e.g. the name of a procedure
+            self.error(error_code=ErrorCode.NOT_A_VARIABLE, token=node.left.token)
+        node.depth = node.left.depth
+        node.slot = node.left.slot
 
     def visit_Var(self, node):
         var_name = node.value
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
             self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+        # resolve the variable to its (depth, slot) address once, so
+        # that the interpreters never look names up at runtime; other
+        # names (e.g. a procedure used as a statement) keep slot None
+        node.depth = self.current_scope.scope_level - var_symbol.scope_level
+        if isinstance(var_symbol, VarSymbol):
+            node.slot = var_symbol.slot
 
     def visit_Num(self, node):
         pass
@@ -1249,7 +2056,7 @@ class SemanticAnalyzer(NodeVisitor):
         pass
 
     def visit_UnaryOp(self, node):
-        pass
+        self.visit(node.expr)
 
     def visit_ProcedureCall(self, node):
         for param_node in node.actual_params:
@@ -1260,6 +2067,493 @@ class SemanticAnalyzer(NodeVisitor):
         node.proc_symbol = proc_symbol
 #endregion
 
+#region Optimizer Class
+###############################################################################
+#  OPTIMIZATION                                                               #
+###############################################################################
+def _tree_size(node):
+    return 1 + sum(_tree_size(child) for child in iter_child_nodes(node))
+
+
+class Optimizer(NodeVisitor):
+    """Simplify a checked tree, in place.
+
+    A BinOp or UnaryOp whose operands are Num, Boolean or String
+    literals is replaced by the literal it evaluates to, computed with
+    the same operators as the interpreters (so DIV stays integer
+    division and mixing integers and reals gives a real). Expressions
+    that would fail at runtime, e.g. a division by zero, are left alone
+    so the error still happens when the statement runs.
+
+    In statement lists, an IfStmt whose condition folded to a literal
+    is replaced by the statements of the branch it would take, nested
+    Compound statements are spliced into the enclosing list and NoOps
+    are dropped.
+    """
+    _LITERALS = (Num, Boolean, String)
+
+    def __init__(self, tracer=None):
+        # number of nodes removed from the tree
+        self.removed_nodes = 0
+        self.tracer = tracer
+
+    def optimize(self, tree):
+        tree = self.visit(tree)
+        if self.tracer is not None:
+            self.tracer.log(f'OPTIMIZER: {self.removed_nodes} nodes removed')
+        return tree
+
+    def _literal(self, value, token):
+        """Return a literal node for value, positioned at token."""
+        if isinstance(value, bool):
+            token_type, node_class = (TokenType.TRUE if value else TokenType.FALSE), Boolean
+        elif isinstance(value, str):
+            token_type, node_class = TokenType.STRING, String
+        elif isinstance(value, int):
+            token_type, node_class = TokenType.INTEGER_CONST, Num
+        else:
+            token_type, node_class = TokenType.REAL_CONST, Num
+        return node_class(Token(token_type, value, token.lineno, token.column))
+
+    def _nodes(self, nodes):
+        return [self.visit(node) for node in nodes]
+
+    def _statements(self, statements):
+        result = []
+        for statement in statements:
+            statement = self.visit(statement)
+            if isinstance(statement, list):
+                # the surviving branch of a constant IfStmt
+                result.extend(statement)
+            elif isinstance(statement, Compound):
+                # BEGIN ... END opens no scope, so its statements can
+                # join the enclosing list
+                result.extend(statement.children)
+                self.removed_nodes += 1
+            elif isinstance(statement, NoOp):
+                self.removed_nodes += 1
+            else:
+                result.append(statement)
+        return result
+
+    def visit_Program(self, node):
+        node.block = self.visit(node.block)
+        return node
+
+    def visit_Block(self, node):
+        node.declarations = self._nodes(node.declarations)
+        node.compound_statement = self.visit(node.compound_statement)
+        return node
+
+    def visit_ProcedureDecl(self, node):
+        # the ProcedureSymbol shares block_node, it sees the folded body
+        node.block_node = self.visit(node.block_node)
+        return node
+
+    def visit_Compound(self, node):
+        node.children = self._statements(node.children)
+        return node
+
+    def visit_Assign(self, node):
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_IfStmt(self, node):
+        node.condition = condition = self.visit(node.condition)
+        if isinstance(condition, self._LITERALS):
+            # only one branch can ever run: return its statements, the
+            # enclosing statement list splices them in
+            if condition.value:
+                taken, dead = node.consequences, node.alternatives
+            else:
+                taken, dead = node.alternatives, node.consequences
+            self.removed_nodes += 1 + _tree_size(condition) + sum(map(_tree_size, dead))
+            return self._statements(taken)
+        node.consequences = self._statements(node.consequences)
+        node.alternatives = self._statements(node.alternatives)
+        return node
+
+    def visit_WriteStmt(self, node):
+        node.expressions = self._nodes(node.expressions)
+        return node
+
+    def visit_ProcedureCall(self, node):
+        node.actual_params = self._nodes(node.actual_params)
+        return node
+
+    def visit_BinOp(self, node):
+        node.left = left = self.visit(node.left)
+        node.right = right = self.visit(node.right)
+        if not (isinstance(left, self._LITERALS) and isinstance(right, self._LITERALS)):
+            return node
+        # the table of the bytecode compiler, so that folding agrees
+        # with what the interpreters compute
+        operator_function = BINARY_OPERATORS[_BINARY_OP_ARGS[node.op.type]]
+        try:
+            value = operator_function(left.value, right.value)
+        except (ArithmeticError, TypeError, ValueError):
+            return node
+        self.removed_nodes += 2
+        return self._literal(value, node.token)
+
+    def visit_UnaryOp(self, node):
+        node.expr = expr = self.visit(node.expr)
+        if not isinstance(expr, self._LITERALS):
+            return node
+        try:
+            value = +expr.value if node.op.type == TokenType.PLUS else -expr.value
+        except TypeError:
+            return node
+        self.removed_nodes += 1
+        return self._literal(value, node.token)
+
+    def visit_VarDecl(self, node):
+        return node
+
+    visit_Var = visit_Num = visit_String = visit_Boolean = visit_NoOp = visit_VarDecl
+
+#endregion
+
+#region Incremental Parser
+###############################################################################
+#  INCREMENTAL PARSING                                                        #
+###############################################################################
+def _advance(text, start, end, lineno, column):
+    """Return the position of text[end], given that of text[start]."""
+    newlines = text.count('\n', start, end)
+    if newlines == 0:
+        return lineno, column + end - start
+    return lineno + newlines, end - text.rfind('\n', start, end)
+
+
+def _iter_tokens(node):
+    """Yield every token held by the nodes of a subtree, once."""
+    seen = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for name in _slot_names(type(node)):
+            value = getattr(node, name, None)
+            if isinstance(value, Token):
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    yield value
+            elif isinstance(value, AST):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(item for item in value if isinstance(item, AST))
+
+
+# two word characters in a row, which lex as one token
+_JOINED_WORDS = re.compile(r'\w\w')
+
+
+class _RelocatedLexer:
+    """Token source: a lexer over part of a file, with file positions.
+
+    The part starts at lineno:column of the file.
+    """
+    def __init__(self, lexer, lineno, column):
+        self.lexer = lexer
+        self.lineno = lineno
+        self.column = column
+
+    def get_next_token(self):
+        token = self.lexer.get_next_token()
+        if token.lineno is not None:
+            if token.lineno == 1:
+                token.column += self.column - 1
+            token.lineno += self.lineno - 1
+        return token
+
+
+class _Unit:
+    """A top-level procedure or statement and where its source is.
+
+    The span runs from start up to end, the offset of the token after
+    the unit; start is at lineno:column. index is the position of the
+    node in Block.declarations or Compound.children. The line numbers
+    of the unit's tokens are `lines` behind until they are updated.
+    """
+    __slots__ = ('kind', 'index', 'start', 'end', 'lineno', 'column', 'lines')
+
+    def __init__(self, kind, index, start, end, lineno, column):
+        self.kind = kind
+        self.index = index
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+        self.column = column
+        self.lines = 0
+
+
+class _UnitParser(Parser):
+    """Parser that also finds the top-level units of the program.
+
+    units lists a _Unit for each procedure declared in the program block
+    and each statement of its body, in source order; offset(token) gives
+    the offset of a token in the text. The units' index is left to the
+    caller.
+    """
+    def __init__(self, lexer, offset):
+        self.offset = offset
+        self.units = []
+        # procedures and statements being parsed, units are the outermost
+        self._nesting = 0
+        self._previous_token = None
+        super().__init__(lexer)
+
+    def eat(self, token_type):
+        self._previous_token = self.current_token
+        super().eat(token_type)
+
+    def procedure_declaration(self):
+        token = self.current_token
+        self._nesting += 1
+        node = super().procedure_declaration()
+        self._nesting -= 1
+        if self._nesting == 0:
+            offset = self.offset
+            self.units.append(_Unit(
+                'procedure', None, offset(token), offset(self.current_token),
+                token.lineno, token.column,
+            ))
+        return node
+
+    def statement(self):
+        # a statement spans from the BEGIN or SEMI before it to the SEMI
+        # or END after it
+        separator = self._previous_token
+        self._nesting += 1
+        node = super().statement()
+        self._nesting -= 1
+        if self._nesting == 0:
+            offset = self.offset
+            width = len(separator.value)
+            self.units.append(_Unit(
+                'statement', None,
+                offset(separator) + width, offset(self.current_token),
+                separator.lineno, separator.column + width,
+            ))
+        return node
+
+
+class IncrementalParser:
+    """Keep the checked tree of a program up to date as its text is edited.
+
+    parse() parses and analyzes the whole program and remembers the span
+    of each top-level procedure declaration and statement. edit() changes
+    the text; when the change is inside one of those spans, only that
+    unit is lexed, parsed and analyzed again and spliced into the tree.
+    Callers keep their ProcedureSymbol, which is updated in place. Edits
+    elsewhere, or that rename a procedure or spill out of their unit,
+    parse the whole text again.
+
+    An edit that adds or removes lines leaves the line numbers of the
+    tokens after it behind, moving them all would take time in the size
+    of the file. update_positions() brings them up to date; analyzing
+    the whole program does it first, so errors are reported right.
+    """
+    def __init__(self, text, lexer_class=RegexLexer):
+        self.text = text
+        self.lexer_class = lexer_class
+        self.tree = None
+        self.global_scope = None
+        # None until parse() succeeds, then sorted by start
+        self.units = None
+        self.full_parses = 0
+        self.unit_parses = 0
+        self._unique_names = False
+
+    def parse(self):
+        """Parse and analyze the whole text, return the Program."""
+        self.units = None
+        self.full_parses += 1
+        text = self.text
+        line_starts = [0]
+        line_starts.extend(match.end() for match in re.finditer('\n', text))
+
+        def offset(token):
+            if token.lineno is None:
+                return len(text)
+            return line_starts[token.lineno - 1] + token.column - 1
+
+        parser = _UnitParser(self.lexer_class(text), offset)
+        tree = parser.parse()
+        # units are found in the order of their nodes
+        procedures = (
+            index for index, node in enumerate(tree.block.declarations)
+            if isinstance(node, ProcedureDecl)
+        )
+        statements = itertools.count()
+        for unit in parser.units:
+            unit.index = next(procedures if unit.kind == 'procedure' else statements)
+        self.tree = tree
+        self._analyze_program()
+        self.units = parser.units
+        return tree
+
+    def update_positions(self):
+        """Move the tokens left behind by edits to their line."""
+        for unit in self.units or ():
+            if unit.lines:
+                self._move_tokens(unit, unit.lines)
+
+    def _move_tokens(self, unit, lines, lineno=None, columns=0):
+        """Move the tokens of unit down by lines, and those on lineno right by columns."""
+        for token in _iter_tokens(self._node(unit)):
+            if token.lineno == lineno:
+                token.column += columns
+            token.lineno += lines
+        unit.lines -= lines
+
+    def _analyze_program(self):
+        self.update_positions()
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(self.tree)
+        self.global_scope = analyzer.global_scope
+        # with every global name declared once, a procedure was analyzed
+        # in the global scope minus the procedures declared after it
+        names = [
+            node.proc_name if isinstance(node, ProcedureDecl) else node.var_node.value
+            for node in self.tree.block.declarations
+        ]
+        builtins = ScopedSymbolTable('builtins', 0)
+        builtins._init_builtins()
+        declared = set(names)
+        self._unique_names = len(declared) == len(names) and declared.isdisjoint(builtins._symbols)
+
+    def edit(self, start, end, text):
+        """Replace self.text[start:end] with text, return the new Program."""
+        old_text = self.text
+        self.text = old_text[:start] + text + old_text[end:]
+        position = self._unit_at(start, end)
+        if position is None or not self._reparse_unit(position, old_text, len(text) - (end - start)):
+            return self.parse()
+        return self.tree
+
+    def _unit_at(self, start, end):
+        """Return the position in self.units of the unit holding start:end."""
+        units = self.units
+        if units is None:
+            return None
+        # the last unit starting at or before start; bisect() takes a
+        # key only from Python 3.10 on
+        low, high = 0, len(units)
+        while low < high:
+            middle = (low + high) // 2
+            if units[middle].start <= start:
+                low = middle + 1
+            else:
+                high = middle
+        position = low - 1
+        if position < 0 or end > units[position].end:
+            return None
+        return position
+
+    def _node(self, unit):
+        block = self.tree.block
+        if unit.kind == 'procedure':
+            return block.declarations[unit.index]
+        return block.compound_statement.children[unit.index]
+
+    def _reparse_unit(self, position, old_text, delta):
+        unit = self.units[position]
+        text = self.text
+        end = unit.end + delta
+        joined = _JOINED_WORDS.match
+        if (unit.start > 0 and joined(text, unit.start - 1)) or joined(text, end - 1):
+            # the unit now runs into the keyword or name next to it
+            return False
+        source = text[unit.start:end]
+        try:
+            parser = Parser(_RelocatedLexer(self.lexer_class(source), unit.lineno, unit.column))
+            if unit.kind == 'procedure':
+                if parser.current_token.type != TokenType.PROCEDURE:
+                    return False
+                node = parser.procedure_declaration()
+            else:
+                node = parser.statement()
+        except (LexerError, ParserError):
+            return False
+        if parser.current_token.type != TokenType.EOF:
+            # the edit changed where the unit ends
+            return False
+        old_node = self._node(unit)
+        if unit.kind == 'procedure' and node.proc_name != old_node.proc_name:
+            return False
+        self.unit_parses += 1
+
+        block = self.tree.block
+        if unit.kind == 'procedure':
+            block.declarations[unit.index] = node
+        else:
+            block.compound_statement.children[unit.index] = node
+        unit.lines = 0
+        self._move_units(position, old_text, delta)
+        try:
+            self._analyze_unit(unit, node)
+        except SemanticError:
+            # parse everything on the next edit
+            self.units = None
+            raise
+        return True
+
+    def _move_units(self, position, old_text, delta):
+        """Move the units after units[position] by the edit made in it."""
+        units = self.units
+        unit = units[position]
+        old_lineno, old_column = _advance(old_text, unit.start, unit.end, unit.lineno, unit.column)
+        unit.end += delta
+        lineno, column = _advance(self.text, unit.start, unit.end, unit.lineno, unit.column)
+        lines = lineno - old_lineno
+        columns = column - old_column
+        for later in units[position + 1:]:
+            later.start += delta
+            later.end += delta
+            if later.lineno == old_lineno:
+                # it starts on the line where the edit ended, its tokens
+                # there move sideways
+                later.column += columns
+                self._move_tokens(later, later.lines)
+                self._move_tokens(later, 0, old_lineno, columns)
+            later.lineno += lines
+            later.lines += lines
+
+    def _analyze_unit(self, unit, node):
+        if unit.kind == 'statement':
+            analyzer = SemanticAnalyzer()
+            analyzer.current_scope = self.global_scope
+            analyzer.visit(node)
+            return
+        if not self._unique_names:
+            self._analyze_program()
+            return
+
+        # the global scope the procedure was declared in
+        global_scope = self.global_scope
+        later = {
+            declaration.proc_name
+            for declaration in self.tree.block.declarations[unit.index + 1:]
+        }
+        scope = ScopedSymbolTable(global_scope.scope_name, global_scope.scope_level)
+        scope._symbols = {
+            name: symbol for name, symbol in global_scope._symbols.items()
+            if name not in later
+        }
+        scope.var_names = global_scope.var_names
+        analyzer = SemanticAnalyzer()
+        analyzer.current_scope = scope
+        analyzer.visit(node)
+
+        # calls elsewhere in the tree refer to the old symbol
+        new_symbol = scope._symbols[node.proc_name]
+        proc_symbol = global_scope._symbols[node.proc_name]
+        proc_symbol.formal_params = new_symbol.formal_params
+        proc_symbol.block_ast = new_symbol.block_ast
+        proc_symbol.var_names = new_symbol.var_names
+#endregion
+
 #region CallStack Class
 ###############################################################################
 #  INTERPRETER                                                                #
@@ -1292,20 +2586,40 @@ class ARType(Enum):
     PROCEDURE = 'PROCEDURE'
 
 class ActivationRecord:
-    def __init__(self, name, type, nesting_level):
+    """A fixed-size frame: variable i of the scope lives in slots[i].
+
+    var_names comes from the scope the record is created for (see
+    ScopedSymbolTable.var_names) and static_link is the record of the
+    lexically enclosing procedure or program, so a Var resolved to
+    (depth, slot) is found by following `depth` static links.
+    """
+    __slots__ = ('name', 'type', 'nesting_level', 'var_names', 'slots', 'static_link')
+
+    def __init__(self, name, type, nesting_level, var_names=(), static_link=None):
         self.name = name
         self.type = type
         self.nesting_level = nesting_level
-        self.members = {}
+        self.var_names = var_names
+        self.slots = [None] * len(var_names)
+        self.static_link = static_link
+
+    def outer(self, depth):
+        """Return the record `depth` static links up from this one."""
+        ar = self
+        for _ in range(depth):
+            ar = ar.static_link
+        return ar
 
     def __setitem__(self, key, value):
-        self.members[key] = value
+        self.slots[self.var_names.index(key)] = value
 
     def __getitem__(self, key):
-        return self.members[key]
+        return self.slots[self.var_names.index(key)]
 
     def get(self, key):
-        return self.members.get(key)
+        if key in self.var_names:
+            return self[key]
+        return None
 
     def __str__(self):
         lines = [
@@ -1315,8 +2629,10 @@ class ActivationRecord:
                 name=self.name,
             )
         ]
-        for name, val in self.members.items():
-            lines.append(f'   {name:<20}: {val}')
+        for name, val in zip(self.var_names, self.slots):
+            # variables that were never assigned are not shown
+            if val is not None:
+                lines.append(f'   {name:<20}: {val}')
 
         s = '\n'.join(lines)
         return s
@@ -1325,33 +2641,33 @@ class ActivationRecord:
         return self.__str__()
 #endregion
 
+
 #region Interpreter Class
 class Interpreter(NodeVisitor):
-    def __init__(self, tree):
+    def __init__(self, tree, output=None, tracer=None):
         self.tree = tree
         self.call_stack = CallStack()
-
-    def log(self, msg):
-        if _SHOULD_LOG_STACK:
-            print(msg)
+        self.output = OutputSink() if output is None else output
+        self.tracer = tracer
 
     def visit_Program(self, node):
         program_name = node.name
-        self.log(f'ENTER: PROGRAM {program_name}')
 
         ar = ActivationRecord(
             name=program_name,
             type=ARType.PROGRAM,
             nesting_level=1,
+            var_names=node.var_names or (),
         )
         self.call_stack.push(ar)
 
-        self.log(str(self.call_stack))
+        if self.tracer is not None:
+            self.tracer.enter(ar, self.call_stack)
 
         self.visit(node.block)
 
-        self.log(f'LEAVE: PROGRAM {program_name}')
-        self.log(str(self.call_stack))
+        if self.tracer is not None:
+            self.tracer.leave(ar, self.call_stack)
 
         self.call_stack.pop()
 
@@ -1410,19 +2726,23 @@ class Interpreter(NodeVisitor):
             self.visit(child)
 
     def visit_Assign(self, node):
-        var_name = node.left.value
         var_value = self.visit(node.right)
 
         ar = self.call_stack.peek()
-        ar[var_name] = var_value
+        if node.depth:
+            ar = ar.outer(node.depth)
+        ar.slots[node.slot] = var_value
 
     def visit_Var(self, node):
-        var_name = node.value
+        slot = node.slot
+        if slot is None:
+            # not a variable, e.g. a procedure name used as a statement
+            return None
 
         ar = self.call_stack.peek()
-        var_value = ar.get(var_name)
-
-        return var_value
+        if node.depth:
+            ar = ar.outer(node.depth)
+        return ar.slots[slot]
 
     def visit_NoOp(self, node):
         pass
@@ -1441,20 +2761,9 @@ class Interpreter(NodeVisitor):
         return node.value
 
     def visit_WriteStmt(self, node):
-        # if there's nothing to print we just print blank.
-        if len(node.expressions) > 0:
-            # iterate the expressions array
-            # get the value of every element and print it out.
-            for expression in node.expressions:
-                value = self.visit(expression)
-                print(value, end=" ")
-            if node.new_line:
-                print() # empty line
-        else:
-            # print blank like Pascal does.
-            print(" ", end=" ")
-            if node.new_line:                
-                print() # empty line
+        # get the value of every expression and write them out.
+        values = [self.visit(expression) for expression in node.expressions]
+        self.output.write_values(values, node.new_line)
 
     def visit_ProcedureDecl(self, node):
         pass
@@ -1463,28 +2772,35 @@ class Interpreter(NodeVisitor):
         proc_name = node.proc_name
         proc_symbol = node.proc_symbol
 
+        # the procedure's static link is the record of the scope it was
+        # declared in, which encloses the caller's
+        caller = self.call_stack.peek()
         ar = ActivationRecord(
             name=proc_name,
             type=ARType.PROCEDURE,
             nesting_level=proc_symbol.scope_level + 1,
+            var_names=proc_symbol.var_names,
+            static_link=caller.outer(caller.nesting_level - proc_symbol.scope_level),
         )
 
         formal_params = proc_symbol.formal_params
         actual_params = node.actual_params
 
+        # parameters take the first slots
+        slots = ar.slots
         for param_symbol, argument_node in zip(formal_params, actual_params):
-            ar[param_symbol.name] = self.visit(argument_node)
+            slots[param_symbol.slot] = self.visit(argument_node)
 
         self.call_stack.push(ar)
 
-        self.log(f'ENTER: PROCEDURE {proc_name}')
-        self.log(str(self.call_stack))
+        if self.tracer is not None:
+            self.tracer.enter(ar, self.call_stack)
 
         # evaluate procedure body
         self.visit(proc_symbol.block_ast)
 
-        self.log(f'LEAVE: PROCEDURE {proc_name}')
-        self.log(str(self.call_stack))
+        if self.tracer is not None:
+            self.tracer.leave(ar, self.call_stack)
 
         self.call_stack.pop()
 
@@ -1492,42 +2808,1435 @@ class Interpreter(NodeVisitor):
         tree = self.tree
         if tree is None:
             return ''
+        try:
+            return self.visit(tree)
+        finally:
+            self.output.flush()
+
+
+class ProfilingInterpreter(Interpreter):
+    """The Interpreter, recording into a Profiler as it goes.
+
+    A procedure's time starts when its call is visited, so evaluating
+    the arguments counts towards the procedure. The counting itself
+    slows the program down several times; compare the times with each
+    other, not with unprofiled runs.
+    """
+    def __init__(self, tree, output=None, tracer=None, profiler=None):
+        super().__init__(tree, output, tracer)
+        self.profiler = Profiler() if profiler is None else profiler
+        self._node_counts = self.profiler.node_counts
+
+    def visit(self, node):
+        name = node.__class__.__name__
+        counts = self._node_counts
+        counts[name] = counts.get(name, 0) + 1
+        return super().visit(node)
+
+    def visit_Program(self, node):
+        self.profiler.enter(node.name)
+        try:
+            super().visit_Program(node)
+        finally:
+            self.profiler.leave()
+
+    def visit_ProcedureCall(self, node):
+        self.profiler.enter(node.proc_symbol.qualified_name)
+        try:
+            super().visit_ProcedureCall(node)
+        finally:
+            self.profiler.leave()
+#endregion
+
+#region Closure Interpreter
+class ClosureInterpreter(NodeVisitor):
+    """Run the program by first compiling every node into a Python closure.
+
+    Each visit_* method returns a function of the current activation
+    record (``f``), e.g. a PLUS BinOp becomes
+    ``lambda f: left(f) + right(f)``. Operators, constants and variable
+    addresses are resolved once at compile time instead of on every run.
+    """
+    _BINARY_CLOSURES = {
+        TokenType.PLUS:          lambda l, r: lambda f: l(f) + r(f),
+        TokenType.MINUS:         lambda l, r: lambda f: l(f) - r(f),
+        TokenType.MUL:           lambda l, r: lambda f: l(f) * r(f),
+        TokenType.INTEGER_DIV:   lambda l, r: lambda f: l(f) // r(f),
+        TokenType.FLOAT_DIV:     lambda l, r: lambda f: float(l(f)) / float(r(f)),
+        TokenType.LESS_THAN:     lambda l, r: lambda f: l(f) < r(f),
+        TokenType.GREATER_THAN:  lambda l, r: lambda f: l(f) > r(f),
+        TokenType.EQUAL:         lambda l, r: lambda f: l(f) == r(f),
+        TokenType.LESS_EQUAL:    lambda l, r: lambda f: l(f) <= r(f),
+        TokenType.GREATER_EQUAL: lambda l, r: lambda f: l(f) >= r(f),
+        TokenType.NOT_EQUAL:     lambda l, r: lambda f: l(f) != r(f),
+    }
+
+    def __init__(self, tree, output=None, tracer=None):
+        self.tree = tree
+        self.call_stack = CallStack()
+        self.output = OutputSink() if output is None else output
+        self.tracer = tracer
+        # ProcedureSymbol -> one-element list holding the compiled body
+        self._procedures = {}
+
+    def interpret(self):
+        tree = self.tree
+        if tree is None:
+            return ''
+        run = self.visit(tree)
+        try:
+            return run()
+        finally:
+            self.output.flush()
+
+    def _sequence(self, statements):
+        closures = tuple(self.visit(statement) for statement in statements)
+        if len(closures) == 1:
+            return closures[0]
+
+        def sequence(f):
+            for closure in closures:
+                closure(f)
+        return sequence
+
+    def visit_Program(self, node):
+        program_name = node.name
+        var_names = node.var_names or ()
+        block = self.visit(node.block)
+
+        def run():
+            ar = ActivationRecord(
+                name=program_name,
+                type=ARType.PROGRAM,
+                nesting_level=1,
+                var_names=var_names,
+            )
+            self.call_stack.push(ar)
+            if self.tracer is not None:
+                self.tracer.enter(ar, self.call_stack)
+
+            block(ar)
+
+            if self.tracer is not None:
+                self.tracer.leave(ar, self.call_stack)
+            self.call_stack.pop()
+        return run
+
+    def visit_Block(self, node):
+        # declarations have no runtime behaviour
+        return self.visit(node.compound_statement)
+
+    def visit_Compound(self, node):
+        return self._sequence(node.children)
+
+    def visit_NoOp(self, node):
+        return lambda f: None
+
+    def visit_Num(self, node):
+        value = node.value
+        return lambda f: value
+
+    visit_String = visit_Boolean = visit_Num
+
+    def visit_Var(self, node):
+        depth, slot = node.depth, node.slot
+        if slot is None:
+            # not a variable, e.g. a procedure name used as a statement
+            return lambda f: None
+        if depth == 0:
+            return lambda f: f.slots[slot]
+        if depth == 1:
+            return lambda f: f.static_link.slots[slot]
+        return lambda f: f.outer(depth).slots[slot]
+
+    def visit_Assign(self, node):
+        depth, slot = node.depth, node.slot
+        right = self.visit(node.right)
+
+        if depth == 0:
+            def assign(f):
+                f.slots[slot] = right(f)
+        else:
+            def assign(f):
+                f.outer(depth).slots[slot] = right(f)
+        return assign
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        return self._BINARY_CLOSURES[node.op.type](left, right)
+
+    def visit_UnaryOp(self, node):
+        expr = self.visit(node.expr)
+        if node.op.type == TokenType.PLUS:
+            return lambda f: +expr(f)
+        elif node.op.type == TokenType.MINUS:
+            return lambda f: -expr(f)
+
+    def visit_IfStmt(self, node):
+        condition = self.visit(node.condition)
+        consequences = self._sequence(node.consequences)
+        alternatives = self._sequence(node.alternatives)
+
+        def if_statement(f):
+            if condition(f):
+                consequences(f)
+            else:
+                alternatives(f)
+        return if_statement
+
+    def visit_WriteStmt(self, node):
+        expressions = tuple(self.visit(expression) for expression in node.expressions)
+        new_line = node.new_line
+        write_values = self.output.write_values
+
+        def write(f):
+            write_values([expression(f) for expression in expressions], new_line)
+        return write
+
+    def visit_ProcedureCall(self, node):
+        proc_name = node.proc_name
+        proc_symbol = node.proc_symbol
+        nesting_level = proc_symbol.scope_level + 1
+        var_names = proc_symbol.var_names
+        arguments = tuple(
+            (param_symbol.slot, self.visit(argument_node))
+            for param_symbol, argument_node
+            in zip(proc_symbol.formal_params, node.actual_params)
+        )
+        body = self._procedure_body(proc_symbol)
+        call_stack = self.call_stack
+        tracer = self.tracer
+
+        def call(f):
+            # static link: the record of the scope the procedure was declared in
+            ar = ActivationRecord(
+                name=proc_name,
+                type=ARType.PROCEDURE,
+                nesting_level=nesting_level,
+                var_names=var_names,
+                static_link=f.outer(f.nesting_level - nesting_level + 1),
+            )
+            slots = ar.slots
+            for slot, argument in arguments:
+                slots[slot] = argument(f)
+
+            call_stack.push(ar)
+            if tracer is not None:
+                tracer.enter(ar, call_stack)
+
+            body[0](ar)
+
+            if tracer is not None:
+                tracer.leave(ar, call_stack)
+            call_stack.pop()
+        return call
+
+    def _procedure_body(self, proc_symbol):
+        body = self._procedures.get(proc_symbol)
+        if body is None:
+            # register before compiling so recursive calls find the holder
+            body = self._procedures[proc_symbol] = []
+            body.append(self.visit(proc_symbol.block_ast))
+        return body
+#endregion
+
+#region Bytecode Compiler
+###############################################################################
+#  BYTECODE COMPILER AND VIRTUAL MACHINE                                      #
+###############################################################################
+class OpCode(IntEnum):
+    LOAD_CONST    = 1   # push constants[arg]
+    LOAD_LOCAL    = 2   # push slot arg of the current record
+    STORE_LOCAL   = 3   # pop a value into slot arg of the current record
+    BINARY_OP     = 4   # pop two values, push BINARY_OPERATORS[arg](left, right)
+    UNARY_PLUS    = 5
+    UNARY_MINUS   = 6
+    JUMP          = 7   # continue at code[arg]
+    JUMP_IF_FALSE = 8   # pop a value, continue at code[arg] if it is false
+    WRITE         = 9   # pop arg values and write them separated by blanks
+    WRITE_NEWLINE = 10
+    CALL          = 11  # call the (code object, argc, hops) stored in constants[arg]
+    RETURN        = 12
+    LOAD_OUTER    = 13  # push the variable at the (depth, slot) in constants[arg]
+    STORE_OUTER   = 14  # pop a value into the (depth, slot) in constants[arg]
+
+
+def _float_div(left, right):
+    return float(left) / float(right)
+
+
+# binary operators in the order of the BINARY_OP argument
+BINARY_OPERATORS = (
+    operator.add,
+    operator.sub,
+    operator.mul,
+    operator.floordiv,
+    _float_div,
+    operator.lt,
+    operator.gt,
+    operator.eq,
+    operator.le,
+    operator.ge,
+    operator.ne,
+)
+
+_BINARY_OP_ARGS = {
+    token_type: index
+    for index, token_type in enumerate((
+        TokenType.PLUS,
+        TokenType.MINUS,
+        TokenType.MUL,
+        TokenType.INTEGER_DIV,
+        TokenType.FLOAT_DIV,
+        TokenType.LESS_THAN,
+        TokenType.GREATER_THAN,
+        TokenType.EQUAL,
+        TokenType.LESS_EQUAL,
+        TokenType.GREATER_EQUAL,
+        TokenType.NOT_EQUAL,
+    ))
+}
+
+
+class CodeObject:
+    """Bytecode of the program body or of a procedure body."""
+    def __init__(self, name, type, nesting_level, var_names=()):
+        self.name = name
+        self.type = type
+        self.nesting_level = nesting_level
+        # names of the variables in slot order, parameters first
+        self.var_names = var_names
+        # flat list of instructions: opcode, argument, opcode, argument, ...
+        self.code = []
+        self.constants = []
+        self._constant_index = {}
+
+    def add_constant(self, value):
+        # the type is part of the key so that 1, 1.0 and True stay distinct
+        key = (type(value), value)
+        index = self._constant_index.get(key)
+        if index is None:
+            index = self._constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def __str__(self):
+        lines = [f'{self.type.value} {self.name}']
+        code = self.code
+        for pc in range(0, len(code), 2):
+            lines.append(f'{pc:>6} {OpCode(code[pc]).name:<15} {code[pc + 1]}')
+        return '\n'.join(lines)
+
+    __repr__ = __str__
+
+
+class Compiler(NodeVisitor):
+    """Lower a checked Program tree into bytecode for the VM.
+
+    Procedures are compiled on their first call site, starting from
+    the ProcedureSymbol the semantic analyzer attached to the call, so
+    a procedure that is never called is never compiled.
+    """
+    def __init__(self):
+        # the code object that instructions are currently emitted into
+        self.code_object = None
+        # ProcedureSymbol -> CodeObject
+        self._procedures = {}
+
+    def compile(self, tree):
         return self.visit(tree)
+
+    def emit(self, opcode, arg=0):
+        code = self.code_object.code
+        code.append(opcode)
+        code.append(arg)
+        # the position of the instruction, used to patch jumps
+        return len(code) - 2
+
+    def patch(self, position, arg):
+        self.code_object.code[position + 1] = arg
+
+    def visit_Program(self, node):
+        program = CodeObject(
+            name=node.name,
+            type=ARType.PROGRAM,
+            nesting_level=1,
+            var_names=node.var_names or (),
+        )
+        self.code_object = program
+        self.visit(node.block)
+        self.emit(OpCode.RETURN)
+        self.code_object = None
+        return program
+
+    def visit_Block(self, node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_VarDecl(self, node):
+        pass
+
+    def visit_ProcedureDecl(self, node):
+        # compiled lazily, see _procedure_code
+        pass
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_NoOp(self, node):
+        pass
+
+    def visit_Num(self, node):
+        self.emit(OpCode.LOAD_CONST, self.code_object.add_constant(node.value))
+
+    visit_String = visit_Boolean = visit_Num
+
+    def visit_Var(self, node):
+        if node.slot is None:
+            # not a variable, e.g. a procedure name used as a statement
+            self.emit(OpCode.LOAD_CONST, self.code_object.add_constant(None))
+        elif node.depth == 0:
+            self.emit(OpCode.LOAD_LOCAL, node.slot)
+        else:
+            address = self.code_object.add_constant((node.depth, node.slot))
+            self.emit(OpCode.LOAD_OUTER, address)
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(OpCode.BINARY_OP, _BINARY_OP_ARGS[node.op.type])
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        if node.op.type == TokenType.PLUS:
+            self.emit(OpCode.UNARY_PLUS)
+        elif node.op.type == TokenType.MINUS:
+            self.emit(OpCode.UNARY_MINUS)
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        if node.depth == 0:
+            self.emit(OpCode.STORE_LOCAL, node.slot)
+        else:
+            address = self.code_object.add_constant((node.depth, node.slot))
+            self.emit(OpCode.STORE_OUTER, address)
+
+    def visit_IfStmt(self, node):
+        self.visit(node.condition)
+        jump_to_else = self.emit(OpCode.JUMP_IF_FALSE)
+        for statement in node.consequences:
+            self.visit(statement)
+        if node.alternatives:
+            jump_to_end = self.emit(OpCode.JUMP)
+            self.patch(jump_to_else, len(self.code_object.code))
+            for statement in node.alternatives:
+                self.visit(statement)
+            self.patch(jump_to_end, len(self.code_object.code))
+        else:
+            self.patch(jump_to_else, len(self.code_object.code))
+
+    def visit_WriteStmt(self, node):
+        for expression in node.expressions:
+            self.visit(expression)
+        self.emit(OpCode.WRITE, len(node.expressions))
+        if node.new_line:
+            self.emit(OpCode.WRITE_NEWLINE)
+
+    def visit_ProcedureCall(self, node):
+        proc_symbol = node.proc_symbol
+        callee = self._procedure_code(proc_symbol)
+        # like the tree walker, extra actual parameters are ignored
+        argc = 0
+        for _, argument_node in zip(proc_symbol.formal_params, node.actual_params):
+            self.visit(argument_node)
+            argc += 1
+        # static links to follow from the caller's record to the record
+        # of the scope the procedure was declared in
+        hops = self.code_object.nesting_level - proc_symbol.scope_level
+        self.emit(OpCode.CALL, self.code_object.add_constant((callee, argc, hops)))
+
+    def _procedure_code(self, proc_symbol):
+        code_object = self._procedures.get(proc_symbol)
+        if code_object is not None:
+            return code_object
+
+        code_object = CodeObject(
+            name=proc_symbol.name,
+            type=ARType.PROCEDURE,
+            nesting_level=proc_symbol.scope_level + 1,
+            var_names=proc_symbol.var_names,
+        )
+        # register before compiling the body so recursive calls find it
+        self._procedures[proc_symbol] = code_object
+
+        caller = self.code_object
+        self.code_object = code_object
+        self.visit(proc_symbol.block_ast)
+        self.emit(OpCode.RETURN)
+        self.code_object = caller
+        return code_object
+#endregion
+
+#region Virtual Machine
+class VM:
+    """Stack machine that executes the bytecode produced by Compiler.
+
+    Procedure calls do not recurse into Python: the caller's state is
+    saved on a frame list and the dispatch loop carries on with the
+    callee's code. More frames than the recursion limit raise
+    RecursionError, as runaway recursion does on the other engines.
+    """
+    def __init__(self, code_object, output=None, tracer=None):
+        self.code_object = code_object
+        self.call_stack = CallStack()
+        self.output = OutputSink() if output is None else output
+        self.tracer = tracer
+
+    def run(self):
+        program = self.code_object
+        ar = ActivationRecord(
+            name=program.name,
+            type=ARType.PROGRAM,
+            nesting_level=program.nesting_level,
+            var_names=program.var_names,
+        )
+        self.call_stack.push(ar)
+        if self.tracer is not None:
+            self.tracer.enter(ar, self.call_stack)
+
+        try:
+            self._execute(program, ar)
+
+            if self.tracer is not None:
+                self.tracer.leave(ar, self.call_stack)
+            self.call_stack.pop()
+        finally:
+            self.output.flush()
+
+    def _execute(self, code_object, ar):
+        # bind everything the loop touches to locals
+        LOAD_CONST = OpCode.LOAD_CONST
+        LOAD_LOCAL = OpCode.LOAD_LOCAL
+        STORE_LOCAL = OpCode.STORE_LOCAL
+        LOAD_OUTER = OpCode.LOAD_OUTER
+        STORE_OUTER = OpCode.STORE_OUTER
+        BINARY_OP = OpCode.BINARY_OP
+        UNARY_PLUS = OpCode.UNARY_PLUS
+        UNARY_MINUS = OpCode.UNARY_MINUS
+        JUMP = OpCode.JUMP
+        JUMP_IF_FALSE = OpCode.JUMP_IF_FALSE
+        WRITE = OpCode.WRITE
+        WRITE_NEWLINE = OpCode.WRITE_NEWLINE
+        CALL = OpCode.CALL
+        RETURN = OpCode.RETURN
+        binary_operators = BINARY_OPERATORS
+        call_stack = self.call_stack
+        tracer = self.tracer
+        write = self.output.write
+        write_values = self.output.write_values
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # saved caller state: (code, constants, ar, slots, pc)
+        frames = []
+        # calls nest as deep as the other engines, which recurse in Python
+        max_frames = sys.getrecursionlimit()
+
+        code = code_object.code
+        constants = code_object.constants
+        slots = ar.slots
+        pc = 0
+
+        while True:
+            opcode = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+
+            if opcode == LOAD_LOCAL:
+                push(slots[arg])
+            elif opcode == LOAD_CONST:
+                push(constants[arg])
+            elif opcode == BINARY_OP:
+                right = pop()
+                stack[-1] = binary_operators[arg](stack[-1], right)
+            elif opcode == STORE_LOCAL:
+                slots[arg] = pop()
+            elif opcode == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif opcode == JUMP:
+                pc = arg
+            elif opcode == CALL:
+                if len(frames) >= max_frames:
+                    raise RecursionError('maximum recursion depth exceeded')
+                callee, argc, hops = constants[arg]
+                callee_ar = ActivationRecord(
+                    name=callee.name,
+                    type=ARType.PROCEDURE,
+                    nesting_level=callee.nesting_level,
+                    var_names=callee.var_names,
+                    static_link=ar.outer(hops),
+                )
+                if argc:
+                    # parameters take the first slots
+                    callee_ar.slots[:argc] = stack[-argc:]
+                    del stack[-argc:]
+                call_stack.push(callee_ar)
+                if tracer is not None:
+                    tracer.enter(callee_ar, call_stack)
+
+                frames.append((code, constants, ar, slots, pc))
+                code = callee.code
+                constants = callee.constants
+                ar = callee_ar
+                slots = ar.slots
+                pc = 0
+            elif opcode == RETURN:
+                if not frames:
+                    return
+                if tracer is not None:
+                    tracer.leave(ar, call_stack)
+                call_stack.pop()
+                code, constants, ar, slots, pc = frames.pop()
+            elif opcode == LOAD_OUTER:
+                depth, slot = constants[arg]
+                push(ar.outer(depth).slots[slot])
+            elif opcode == STORE_OUTER:
+                depth, slot = constants[arg]
+                ar.outer(depth).slots[slot] = pop()
+            elif opcode == UNARY_MINUS:
+                stack[-1] = -stack[-1]
+            elif opcode == UNARY_PLUS:
+                stack[-1] = +stack[-1]
+            elif opcode == WRITE:
+                if arg:
+                    write_values(stack[-arg:], False)
+                    del stack[-arg:]
+                else:
+                    write_values((), False)
+            elif opcode == WRITE_NEWLINE:
+                write('\n')
+#endregion
+
+#region Python Code Generator
+###############################################################################
+#  PASCAL TO PYTHON TRANSLATION                                               #
+###############################################################################
+class PythonCodeGenerator(NodeVisitor):
+    """Translate a checked Program tree into Python source code.
+
+    The program body becomes a function and every procedure a function
+    nested in the one of its enclosing scope; variables and parameters
+    are locals of those functions. Python closures then give Pascal's
+    lexical scoping, and assignments to a variable of an enclosing scope
+    are declared ``nonlocal``. Names get a prefix (``v_`` for variables,
+    ``p_`` for procedures) so they never clash with Python keywords.
+    """
+    _BINARY_FORMATS = {
+        TokenType.PLUS:          '({} + {})',
+        TokenType.MINUS:         '({} - {})',
+        TokenType.MUL:           '({} * {})',
+        TokenType.INTEGER_DIV:   '({} // {})',
+        TokenType.FLOAT_DIV:     '(float({}) / float({}))',
+        TokenType.LESS_THAN:     '({} < {})',
+        TokenType.GREATER_THAN:  '({} > {})',
+        TokenType.EQUAL:         '({} == {})',
+        TokenType.LESS_EQUAL:    '({} <= {})',
+        TokenType.GREATER_EQUAL: '({} >= {})',
+        TokenType.NOT_EQUAL:     '({} != {})',
+    }
+
+    def __init__(self):
+        self.lines = []
+        self.level = 0
+        # innermost last: ({name: 'var' | 'proc'}, names declared nonlocal)
+        self.scopes = []
+
+    @staticmethod
+    def runtime_globals(output):
+        """Globals to exec the generated code in, writing to output."""
+        return {'__name__': '__pascal__', '_write_values': output.write_values}
+
+    def generate(self, tree):
+        self.visit(tree)
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, line):
+        self.lines.append('    ' * self.level + line)
+
+    def _resolve(self, name):
+        for level, (names, _) in enumerate(reversed(self.scopes)):
+            kind = names.get(name)
+            if kind is not None:
+                return kind, level
+        return None, None
+
+    def _function(self, header, names, block):
+        """Emit `def header:` with the block as its body."""
+        self.emit(f'def {header}:')
+        self.level += 1
+        body_start = len(self.lines)
+        nonlocals = set()
+        self.scopes.append((names, nonlocals))
+
+        self.visit(block)
+        if len(self.lines) == body_start:
+            self.emit('pass')
+
+        self.scopes.pop()
+        if nonlocals:
+            declaration = 'nonlocal ' + ', '.join(sorted(nonlocals))
+            self.lines.insert(body_start, '    ' * self.level + declaration)
+        self.level -= 1
+
+    def visit_Program(self, node):
+        self.emit(f'# generated by SPI {__version__} from PROGRAM {node.name}')
+        self._function('program()', {}, node.block)
+        self.emit('program()')
+
+    def visit_Block(self, node):
+        for declaration in node.declarations:
+            self.visit(declaration)
+        self.visit(node.compound_statement)
+
+    def visit_VarDecl(self, node):
+        var_name = node.var_node.value
+        self.scopes[-1][0][var_name] = 'var'
+        self.emit(f'v_{var_name} = None')
+
+    def visit_ProcedureDecl(self, node):
+        proc_name = node.proc_name
+        self.scopes[-1][0][proc_name] = 'proc'
+        # like the tree walker, parameters without an argument are None
+        params = [param.var_node.value for param in node.formal_params]
+        header = 'p_{}({})'.format(
+            proc_name, ', '.join(f'v_{param}=None' for param in params)
+        )
+        names = {param: 'var' for param in params}
+        self._function(header, names, node.block_node)
+
+    def visit_Compound(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visit_NoOp(self, node):
+        pass
+
+    def _statements(self, statements):
+        self.level += 1
+        body_start = len(self.lines)
+        for statement in statements:
+            self.visit(statement)
+        if len(self.lines) == body_start:
+            self.emit('pass')
+        self.level -= 1
+
+    def visit_IfStmt(self, node):
+        self.emit(f'if {self.expression(node.condition)}:')
+        self._statements(node.consequences)
+        if node.alternatives:
+            self.emit('else:')
+            self._statements(node.alternatives)
+
+    def visit_Assign(self, node):
+        var_name = node.left.value
+        kind, level = self._resolve(var_name)
+        if level:
+            self.scopes[-1][1].add(f'v_{var_name}')
+        self.emit(f'v_{var_name} = {self.expression(node.right)}')
+
+    def visit_Var(self, node):
+        # a lone identifier statement, e.g. a procedure name: no effect
+        pass
+
+    def visit_WriteStmt(self, node):
+        values = [self.expression(expression) for expression in node.expressions]
+        # a trailing comma keeps a single value a tuple
+        values = ', '.join(values) + (',' if len(values) == 1 else '')
+        self.emit(f'_write_values(({values}), {node.new_line})')
+
+    def visit_ProcedureCall(self, node):
+        arguments = [
+            self.expression(argument_node)
+            for _, argument_node
+            in zip(node.proc_symbol.formal_params, node.actual_params)
+        ]
+        self.emit('p_{}({})'.format(node.proc_name, ', '.join(arguments)))
+
+    def expression(self, node):
+        """Return the Python source of an expression node."""
+        if isinstance(node, BinOp):
+            return self._BINARY_FORMATS[node.op.type].format(
+                self.expression(node.left),
+                self.expression(node.right),
+            )
+        elif isinstance(node, UnaryOp):
+            sign = '+' if node.op.type == TokenType.PLUS else '-'
+            return f'({sign}{self.expression(node.expr)})'
+        elif isinstance(node, Var):
+            kind, _ = self._resolve(node.value)
+            return f'v_{node.value}' if kind == 'var' else 'None'
+        else:
+            # Num, String and Boolean literals
+            return repr(node.value)
+
+
+def _user_cache_key():
+    """Return this user's secret for signing cache entries, or None.
+
+    The key is made on first use, in a file only the user can read.
+    """
+    directory = os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'spi'
+    )
+    path = os.path.join(directory, 'cache-key')
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(os.urandom(32))
+        with open(path, 'rb') as f:
+            info = os.fstat(f.fileno())
+            if info.st_mode & 0o077 or (
+                    hasattr(os, 'getuid') and info.st_uid != os.getuid()):
+                # readable or planted by someone else, so not a secret
+                return None
+            key = f.read()
+    except OSError:
+        return None
+    return key if len(key) == 32 else None
+
+
+# hash of the source of this module, see _implementation_digest()
+_implementation = None
+
+
+def _implementation_digest():
+    """Return a hash of spi.py's own source, part of every cache key.
+
+    Cached trees and code are only valid for the spi.py that made them,
+    and its node layouts and generated code change between releases.
+    """
+    global _implementation
+    if _implementation is None:
+        try:
+            with open(__file__, 'rb') as f:
+                source = f.read()
+        except OSError:
+            source = __version__.encode('utf-8')
+        _implementation = hashlib.sha256(source).hexdigest()
+    return _implementation
+
+
+# loads that run with the garbage collector paused, see _gc_paused()
+_gc_lock = threading.Lock()
+_gc_pauses = 0
+_gc_was_enabled = False
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Pause the garbage collector, safely when threads do it at once.
+
+    gc is process-wide: it is disabled by the first of overlapping
+    pauses and enabled again, if it was before, by the last.
+    """
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if _gc_pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if _gc_pauses == 0 and _gc_was_enabled:
+                gc.enable()
+
+
+class SourceCache:
+    """On-disk cache of artifacts compiled from Pascal source text.
+
+    Entries are keyed by a hash of the source and of spi.py itself,
+    much like CPython's __pycache__, so an edited file or any change
+    to the interpreter simply misses. Unreadable entries are misses too.
+
+    Entries are unpickled or executed, so each one starts with an HMAC
+    of its name and contents under a per-user key (see
+    _user_cache_key()). Entries someone else wrote into the directory
+    fail the check and are misses; without a key nothing is cached.
+    """
+    DIRECTORY_NAME = '__spicache__'
+    _MAC_SIZE = hashlib.sha256().digest_size
+
+    def __init__(self, directory, key=None):
+        self.directory = directory
+        self.key = _user_cache_key() if key is None else key
+
+    @classmethod
+    def for_source_file(cls, path):
+        return cls(os.path.join(os.path.dirname(os.path.abspath(path)), cls.DIRECTORY_NAME))
+
+    def path(self, text, suffix):
+        key = f'{_implementation_digest()}\n{text}'
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        filename = f'{digest}.{sys.implementation.cache_tag}.{suffix}'
+        return os.path.join(self.directory, filename)
+
+    def _mac(self, path, data):
+        message = os.path.basename(path).encode('utf-8') + b'\0' + data
+        return hmac.new(self.key, message, hashlib.sha256).digest()
+
+    def load(self, text, suffix):
+        if self.key is None:
+            return None
+        path = self.path(text, suffix)
+        try:
+            with open(path, 'rb') as f:
+                entry = f.read()
+        except OSError:
+            return None
+        mac, data = entry[:self._MAC_SIZE], entry[self._MAC_SIZE:]
+        if not hmac.compare_digest(mac, self._mac(path, data)):
+            return None
+        return data
+
+    def store(self, text, suffix, data):
+        if self.key is None:
+            return
+        path = self.path(text, suffix)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(self._mac(path, data))
+                f.write(data)
+            # atomic, so concurrent runs never read a partial entry
+            os.replace(tmp_path, path)
+        except OSError:
+            # caching is best effort
+            pass
+
+    def load_code(self, text):
+        data = self.load(text, 'pyc')
+        if data is not None:
+            try:
+                return marshal.loads(data)
+            except (EOFError, ValueError, TypeError):
+                pass
+        return None
+
+    def store_code(self, text, code):
+        self.store(text, 'pyc', marshal.dumps(code))
+
+    def load_tree(self, text, variant):
+        """Return the checked AST stored by store_tree(), or None."""
+        data = self.load(text, self._tree_suffix(variant))
+        if data is not None:
+            # a tree is many small objects and no garbage, collecting
+            # while they are created would dominate the load time
+            with _gc_paused():
+                try:
+                    return pickle.loads(data)
+                except (pickle.UnpicklingError, EOFError, AttributeError,
+                        ImportError, IndexError, TypeError, ValueError):
+                    pass
+        return None
+
+    def store_tree(self, text, variant, tree):
+        """Store a tree that passed semantic analysis.
+
+        The variant names the front-end options the tree depends on.
+        Symbols the analyzer attached to nodes are pickled along.
+        """
+        try:
+            data = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # too deeply nested for pickle, the front end runs every time
+            return
+        self.store(text, self._tree_suffix(variant), data)
+
+    @staticmethod
+    def _tree_suffix(variant):
+        # pickles name the module of their classes, which is __main__
+        # when spi.py runs as a script and spi when it is imported
+        return f'{__name__}.{variant}.ast'
 #endregion
 
 #region Main Function
+def argument_parser():
+    """Return the parser of the command line options of main()."""
+    parser = argparse.ArgumentParser(
+        description='SPI - Simple Pascal Interpreter'
+    )
+    parser.add_argument(
+        'inputfile',
+        nargs='*',
+        help='Pascal source file (runs a built-in example when omitted)',
+    )
+    parser.add_argument(
+        '--scope',
+        help='Print scope information',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--stack',
+        help='Print call stack',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--engine',
+        help='Execution engine: AST walker (reference), bytecode VM, '
+             'compiled closures or generated Python code',
+        choices=('ast', 'vm', 'closure', 'python'),
+        default='ast',
+    )
+    parser.add_argument(
+        '--lexer',
+        help='Scanner: character at a time (reference), master regex, or '
+             'master regex reading the file in chunks (no caching)',
+        choices=('char', 'regex', 'stream'),
+        default='char',
+    )
+    parser.add_argument(
+        '--pretokenize',
+        help='Lex the whole source into a token array before parsing',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--no-opt',
+        help='Do not fold constant expressions',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--opt-stats',
+        help='Print how many nodes the optimizer removed',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--mem-report',
+        help='Print node counts and memory used by the parsed tree',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--profile',
+        help='Print calls and time per procedure and visits per node type '
+             '(--engine=ast only)',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--profile-output',
+        metavar='PATH',
+        help='Also write the profile to PATH, see --profile-format',
+    )
+    parser.add_argument(
+        '--profile-format',
+        help='Format of --profile-output: JSON, or collapsed stacks for '
+             'flame graph tools',
+        choices=('json', 'collapsed'),
+        default='json',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='Directory for compiled code and checked trees '
+             f'(default: {SourceCache.DIRECTORY_NAME} next to the input file)',
+    )
+    parser.add_argument(
+        '--no-cache',
+        help='Neither read nor write compiled code and checked trees',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--batch',
+        help='Run every input file (paths or glob patterns, read from stdin '
+             'one per line when none are given or the input is -) and print '
+             'one JSON line per program',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--serve',
+        metavar='SOCKET',
+        help='Stay resident and run the programs sent to the Unix socket '
+             'SOCKET, each connection in a process of its own, see '
+             'spi_client.py',
+    )
+    parser.add_argument(
+        '--time-limit',
+        metavar='SECONDS',
+        type=float,
+        help='With --serve, stop a program that runs longer than SECONDS '
+             '(default: 60)',
+    )
+    return parser
+
+
 def main():
-    text = """
-    PROGRAM Main;
-      procedure Alpha;
-      Begin
-        WriteLn('Hello Alpha')
-      End;
-    BEGIN
-      Alpha;
-    END.
-    """
-    lexer = Lexer(text)
+    parser = argument_parser()
+    args = parser.parse_args()
+    profile = args.profile or args.profile_output is not None
+    if profile and args.engine != 'ast':
+        parser.error('--profile works with --engine=ast only')
+    if args.batch:
+        if args.profile_output is not None:
+            parser.error('--profile-output does not work with --batch')
+        sys.exit(run_batch(args, batch_sources(args.inputfile)))
+    if args.time_limit is not None and args.serve is None:
+        parser.error('--time-limit works with --serve only')
+    if args.time_limit is not None and args.time_limit <= 0:
+        parser.error('--time-limit must be positive')
+    if args.serve is not None:
+        serve(args.serve, args.time_limit or 60.0)
+        return
+    if len(args.inputfile) > 1:
+        parser.error('more than one input file needs --batch')
+    path = args.inputfile[0] if args.inputfile else None
+
+    # program output and trace events share one buffered sink
+    output = OutputSink()
+
+    cache = None
+    if path is None:
+        text = """
+        PROGRAM Main;
+          procedure Alpha;
+          Begin
+            WriteLn('Hello Alpha')
+          End;
+        BEGIN
+          Alpha;
+        END.
+        """
+    elif args.lexer == 'stream':
+        # the source is never held in memory as a whole, so there is
+        # no text to key the cache with
+        text = None
+    else:
+        text = open(path, 'r').read()
+        if args.cache_dir is not None:
+            cache = SourceCache(args.cache_dir)
+        else:
+            cache = SourceCache.for_source_file(path)
+    if args.no_cache:
+        cache = None
+
     try:
-        parser = Parser(lexer)
-        tree = parser.parse()
-    except (LexerError, ParserError) as e:
-        print(e.message)
+        run_program(text, args, output, path, cache)
+    except Exception as e:
+        output.flush()
+        print(error_message(e))
         sys.exit(1)
 
-    semantic_analyzer = SemanticAnalyzer()
+
+def error_message(error):
+    """Return the message main() prints for an error a program raised."""
+    if isinstance(error, Error):
+        return error.message
+    return f'{error.__class__.__name__}: {error}'
+
+
+def run_program(text, args, output, path=None, cache=None):
+    """Run one program the way main() does with the options in args.
+
+    text is the source, or None to stream it from path. Program output
+    and trace events go to output. Errors are raised, not reported:
+    LexerError, ParserError, SemanticError, or whatever the running
+    program raises.
+    """
+    profile = args.profile or args.profile_output is not None
+    scope_tracer = Tracer(output) if args.scope else None
+    stack_tracer = Tracer(output) if args.stack else None
+    opt_tracer = Tracer(output) if args.opt_stats else None
+
+    # generated Python code is cached, a hit skips the front end entirely
+    python_code = None
+    if args.engine == 'python' and cache is not None:
+        python_code = cache.load_code(text)
+
+    # so is the checked tree, unless the front end has to report something
+    tree = None
+    variant = 'noopt' if args.no_opt else 'opt'
+    front_end_output = args.scope or args.opt_stats or args.mem_report
+    if python_code is None and cache is not None and not front_end_output:
+        tree = cache.load_tree(text, variant)
+
+    if python_code is None and tree is None:
+        if args.lexer == 'stream' and text is None:
+            lexer = Lexer.from_file(path)
+        elif args.lexer == 'stream':
+            lexer = StreamLexer(io.StringIO(text))
+        elif args.lexer == 'regex':
+            lexer = RegexLexer(text)
+        else:
+            lexer = Lexer(text)
+        tokens = None
+        # a file streamed by the lexer is closed on errors too
+        with lexer:
+            if args.pretokenize:
+                tokens = TokenArray.from_lexer(lexer)
+                tree = Parser(tokens.cursor()).parse()
+            else:
+                tree = Parser(lexer).parse()
+
+        SemanticAnalyzer(scope_tracer).visit(tree)
+
+        if not args.no_opt:
+            tree = Optimizer(opt_tracer).optimize(tree)
+
+        if args.mem_report and tokens is not None:
+            output.write(tokens.memory_report() + '\n')
+        if args.mem_report:
+            output.write(ast_memory_report(tree) + '\n')
+
+        if cache is not None:
+            cache.store_tree(text, variant, tree)
+
+    if args.engine == 'python' and python_code is None:
+        source = PythonCodeGenerator().generate(tree)
+        python_code = compile(source, path or '<pascal>', 'exec')
+        if cache is not None:
+            cache.store_code(text, python_code)
+
+    if args.engine == 'python':
+        try:
+            exec(python_code, PythonCodeGenerator.runtime_globals(output))
+        finally:
+            output.flush()
+    elif args.engine == 'vm':
+        code_object = Compiler().compile(tree)
+        VM(code_object, output, stack_tracer).run()
+    elif args.engine == 'closure':
+        ClosureInterpreter(tree, output, stack_tracer).interpret()
+    elif profile:
+        profiler = Profiler()
+        try:
+            ProfilingInterpreter(tree, output, stack_tracer, profiler).interpret()
+        finally:
+            # also the profile of a program that failed, up to the error
+            if args.profile:
+                output.write(profiler.report() + '\n')
+                output.flush()
+            if args.profile_output is not None:
+                with open(args.profile_output, 'w') as f:
+                    if args.profile_format == 'json':
+                        f.write(profiler.to_json() + '\n')
+                    else:
+                        f.write(profiler.to_collapsed())
+    else:
+        interpreter = Interpreter(tree, output, stack_tracer)
+        interpreter.interpret()
+
+
+def batch_sources(patterns):
+    """Yield the files named by --batch inputs, expanding glob patterns.
+
+    Without patterns, or with just '-', paths are read from stdin, one
+    per line, as they arrive.
+    """
+    if not patterns or patterns == ['-']:
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                yield line
+        return
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            yield from sorted(glob.glob(pattern, recursive=True))
+        else:
+            yield pattern
+
+
+def run_captured(args, path=None, text=None, caches=None):
+    """Run one program with its output captured, return a result dict.
+
+    The program is read from path unless its text is given. caches maps
+    cache directories to the SourceCache used for them, pass the same
+    dict to every call to keep them. Errors end up in the result, only
+    a crash of the process itself escapes.
+    """
+    output = OutputSink.capture()
+    result = {'file': path}
+    start = time.perf_counter()
     try:
-        semantic_analyzer.visit(tree)
-    except SemanticError as e:
-        print(e.message)
-        sys.exit(1)
+        cache = None
+        if text is None and args.lexer != 'stream':
+            with open(path, 'r') as f:
+                text = f.read()
+        if (path is not None and text is not None and caches is not None
+                and not args.no_cache):
+            directory = args.cache_dir or os.path.join(
+                os.path.dirname(os.path.abspath(path)),
+                SourceCache.DIRECTORY_NAME,
+            )
+            cache = caches.get(directory)
+            if cache is None:
+                cache = caches[directory] = SourceCache(directory)
+        run_program(text, args, output, path, cache)
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = error_message(e)
+    result['time'] = time.perf_counter() - start
+    result['output'] = output.getvalue()
+    return result
+
+
+def run_batch(args, sources):
+    """Run each source in a fresh interpreter, print a JSON line per run.
+
+    Every program gets its own captured output, so one program's output
+    or failure never reaches another's. Imports, dispatch tables and the
+    on-disk caches stay warm from one program to the next. Returns the
+    exit status: 1 if any program failed.
+    """
+    caches = {}
+    failed = False
+    for path in sources:
+        result = run_captured(args, path, caches=caches)
+        failed = failed or result['status'] != 'ok'
+        print(json.dumps(result), flush=True)
+    return 1 if failed else 0
+
+
+def _request_args(options):
+    """Parse the spi.py options of a --serve request."""
+    parser = argument_parser()
+
+    def error(message):
+        raise ValueError(message)
+
+    def exit(status=0, message=None):
+        raise ValueError('options that exit are not supported')
+    # neither print to the server's streams nor stop it, e.g. on --help
+    parser.error = error
+    parser.exit = exit
+    parser.print_help = lambda file=None: None
+    args = parser.parse_args(options)
+    if (args.batch or args.serve is not None or args.inputfile
+            or args.time_limit is not None):
+        raise ValueError('requests take no files, --batch, --serve or --time-limit')
+    if args.profile_output is not None:
+        raise ValueError('--profile-output does not work with --serve')
+    return args
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """One client connection: a JSON request per line, answered in kind.
+
+    A request is {"source": text, "path": file, "options": [...]} where
+    source or path is given, path keys the on-disk caches, and options
+    are spi.py options such as --scope or --engine=vm. The answer is the
+    result dict of run_captured().
+    """
+    def handle(self):
+        time_limit = self.server.time_limit
+
+        def time_out(signum, frame):
+            raise TimeoutError(f'the program ran longer than {time_limit:g} s')
+        # the handler runs in a process of its own, see _Server
+        signal.signal(signal.SIGALRM, time_out)
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                args = _request_args(request.get('options', []))
+                source, path = request.get('source'), request.get('path')
+                if source is None and path is None:
+                    raise ValueError('a request needs a source or a path')
+            except (ValueError, TypeError, AttributeError) as e:
+                result = {'status': 'error', 'error': f'Bad request: {e}'}
+            else:
+                signal.setitimer(signal.ITIMER_REAL, time_limit)
+                try:
+                    result = run_captured(args, path, source, self.server.caches)
+                finally:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """Serves each connection in a forked copy of the server process.
+
+    The copy starts with everything the server has imported and warmed
+    up, and nothing a program does there reaches the server or other
+    connections: a program that kills its process (e.g. out of C stack)
+    only drops its own connection, and state such as the recursion
+    limit, gc and the caches is never shared between running programs.
+    Closing the server does not wait for them, see serve().
+    """
+    block_on_close = False
+
+    def __init__(self, address, time_limit):
+        super().__init__(address, _RequestHandler)
+        # seconds a request may run before it fails with TimeoutError
+        self.time_limit = time_limit
+        # SourceCache per cache directory, for the requests of a connection
+        self.caches = {}
+
+
+def _warm_up():
+    """Run a small program on every engine, for the forks to inherit."""
+    text = """
+    program WarmUp;
+    var x : integer;
+    procedure P(n : integer);
+    begin
+       begin if n > 0 then x := x + n * 2 DIV 1; P(n - 1) end
+    end;
+    begin x := 0; P(3); WriteLn(x, 'ok') end.
+    """
+    for engine in ('ast', 'vm', 'closure', 'python'):
+        run_captured(_request_args([f'--engine={engine}']), text=text)
+
+
+def serve(address, time_limit=60.0):
+    """Run programs sent to the Unix socket address until interrupted.
+
+    Each request may run for time_limit seconds. SIGTERM stops the
+    server like Ctrl-C, removing the socket file and stopping the
+    programs still running.
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     try:
-        interpreter = Interpreter(tree)
-        interpreter.interpret()
-    except RuntimeError as e:
-        print(e.message)
-        sys.exit(1)
+        if stat.S_ISSOCK(os.stat(address).st_mode):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(address)
+            sys.exit(
+                f'{sys.argv[0]}: a server is already running on {address}'
+            )
+    except FileNotFoundError:
+        pass
+    except ConnectionRefusedError:
+        # left over from a server that did not shut down cleanly
+        os.unlink(address)
+    _warm_up()
+    with _Server(address, time_limit) as server:
+        print(f'SPI serving on {address}', file=sys.stderr, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # a second Ctrl-C or SIGTERM must not cut the shutdown short
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            os.unlink(address)
+            # children take SIGTERM like the server and exit at once
+            for pid in server.active_children or ():
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
 
 if __name__ == '__main__':
     main()
-#endregion
\ No newline at end of file
+#endregion
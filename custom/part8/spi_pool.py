@@ -0,0 +1,186 @@
+"""Run many Pascal programs on all cores.
+
+Usage:
+    python spi_pool.py [-j JOBS] [spi options] FILE_OR_PATTERN...
+    find . -name '*.pas' | python spi_pool.py [-j JOBS] [spi options]
+
+Keeps JOBS long-lived worker processes with the interpreter imported and
+its caches warm, and prints one JSON line per program, like spi.py --batch
+and in the order the programs were given. Any spi.py option except
+--batch and --profile-output applies to every program. A worker that dies
+(killed, out of memory, or out of C stack on deep Pascal recursion with a
+raised --recursion-limit) is reported as a crash of its program and
+replaced, the rest of the batch carries on.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.connection import wait
+
+import spi
+
+
+def _worker_main(conn, options, recursion_limit):
+    """Run (path, text) jobs from conn until it closes or sends None."""
+    args = spi.argument_parser().parse_args(options)
+    if recursion_limit is not None:
+        sys.setrecursionlimit(recursion_limit)
+    caches = {}
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        path, text = job
+        conn.send(spi.run_captured(args, path, text, caches))
+
+
+class _Worker:
+    def __init__(self, context, options, recursion_limit):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, options, recursion_limit),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        # index, path and start time of the job the worker is running
+        self.job = None
+
+    def send(self, index, path, text):
+        self.job = index, path, time.perf_counter()
+        self.conn.send((path, text))
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+        self.process.join()
+
+
+class ProgramPool:
+    """Worker processes that run programs with the spi.py options given.
+
+    run() takes (path, text) jobs, text None meaning read the file, and
+    yields the result dicts of spi.run_captured() in job order. Use the
+    pool as a context manager, or call close(), to stop the workers.
+    """
+    def __init__(self, processes=None, options=(), recursion_limit=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.options = list(options)
+        self.recursion_limit = recursion_limit
+        self._context = multiprocessing.get_context()
+        # parse once here, so that bad options fail before any worker starts
+        spi.argument_parser().parse_args(self.options)
+        self._workers = [self._start_worker() for _ in range(self.processes)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_worker(self):
+        return _Worker(self._context, self.options, self.recursion_limit)
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def run(self, jobs):
+        jobs = enumerate(jobs)
+        # finished results waiting for an earlier job, bounded by window
+        results = {}
+        window = self.processes * 4
+        next_index = 0
+        submitted = 0
+        exhausted = False
+        idle = list(self._workers)
+        busy = {}
+        while True:
+            while idle and not exhausted and submitted < next_index + window:
+                try:
+                    index, (path, text) = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                worker = idle.pop()
+                worker.send(index, path, text)
+                busy[worker.conn] = worker
+                submitted += 1
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+            if not busy:
+                if exhausted:
+                    return
+                continue
+            for conn in wait(list(busy)):
+                worker = busy.pop(conn)
+                index, path, start = worker.job
+                try:
+                    results[index] = conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join()
+                    # the keys of every other result, as run_captured() has them
+                    results[index] = {
+                        'file': path,
+                        'status': 'crashed',
+                        'error': 'worker exited with code '
+                                 f'{worker.process.exitcode}',
+                        'time': time.perf_counter() - start,
+                        'output': '',
+                    }
+                    conn.close()
+                    self._workers.remove(worker)
+                    worker = self._start_worker()
+                    self._workers.append(worker)
+                worker.job = None
+                idle.append(worker)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run Pascal programs in a pool of worker processes',
+        epilog='Other options are passed to spi.py, see spi.py --help',
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Number of worker processes (default: number of CPUs)',
+    )
+    parser.add_argument(
+        '--recursion-limit',
+        type=int,
+        help='Python recursion limit of the workers, raise it for deeply '
+             'recursive Pascal programs',
+    )
+    args, options = parser.parse_known_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    spi_args = spi.argument_parser().parse_args(options)
+    if spi_args.batch or spi_args.profile_output is not None:
+        parser.error('--batch and --profile-output are not pool options')
+
+    failed = False
+    jobs = ((path, None) for path in spi.batch_sources(spi_args.inputfile))
+    with ProgramPool(args.jobs, options, args.recursion_limit) as pool:
+        for result in pool.run(jobs):
+            failed = failed or result['status'] != 'ok'
+            print(json.dumps(result), flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
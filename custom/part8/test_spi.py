@@ -0,0 +1,726 @@
+"""Tests for the custom/part8 SPI.
+
+Run with `python test_spi.py` (or pytest) from this directory.
+"""
+
+import gc
+import hashlib
+import io
+import json
+import os
+import pickle
+import random
+import re
+import socket
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import spi
+import spi_client
+import spi_pool
+from spi import (
+    AST,
+    BinOp,
+    IncrementalParser,
+    Lexer,
+    LexerError,
+    Num,
+    Optimizer,
+    OutputSink,
+    Parser,
+    ParserError,
+    SemanticAnalyzer,
+    SemanticError,
+    SourceCache,
+    String,
+    Symbol,
+    Token,
+    TokenArray,
+    TokenType,
+    argument_parser,
+    iter_child_nodes,
+    run_program,
+)
+
+
+PROGRAM = """\
+program Main;
+var x, y : integer;
+var r : real;
+
+procedure Alpha(a : integer; b : integer);
+var x : integer;
+
+   procedure Beta(a : integer; b : integer);
+   var x : integer;
+   begin
+      x := a * 10 + b * 2;
+      WriteLn('beta', x, a, b)
+   end;
+
+begin
+   x := (a + b ) * 2;
+   Beta(5, 10);      { procedure call }
+   WriteLn('alpha', x, -x, +x)
+end;
+
+procedure Count(n : integer);
+begin
+   if n > 0 then
+      Write(n);
+      Count(n - 1)
+end;
+
+begin { Main }
+   Alpha(3 + 5, 7);  { procedure call }
+   x := 10 * 4 DIV 2 + 3;
+   r := 7 / 2 + 3.14;
+   begin if x = 23 then WriteLn('eq') else WriteLn('ne') end;
+   Count(3);
+   y := x - 1;
+   r := 1; x := 2; WriteLn(x, r)
+   ; WriteLn(x, y, r)
+end.  { Main }
+"""
+
+
+ENGINE_PROGRAMS = {
+    'static links': """\
+program Links;
+var g, depth : integer;
+
+procedure Outer(a : integer);
+var x : integer;
+
+   procedure Middle(b : integer);
+   var y : integer;
+
+      procedure Inner(c : integer);
+      var x : integer;
+      begin
+         x := c * 100;
+         y := y + a + b + c;
+         g := g + 1;
+         WriteLn('inner', x, y, a, b, c, g)
+      end;
+
+   begin
+      y := b;
+      Inner(b + 1);
+      Inner(b + 2);
+      x := x + y;
+      WriteLn('middle', x, y)
+   end;
+
+   procedure Sibling;
+   begin
+      x := x * 2;
+      Middle(x)
+   end;
+
+begin
+   x := a;
+   Middle(a * 10);
+   Sibling();
+   WriteLn('outer', x, g)
+end;
+
+begin
+   g := 0;
+   Outer(1);
+   Outer(2);
+   WriteLn('main', g)
+end.
+""",
+    'recursion': """\
+program Recursion;
+var total, calls : integer;
+
+procedure Sum(n : integer);
+begin
+   calls := calls + 1;
+   begin if n > 0 then total := total + n; Sum(n - 1) end
+end;
+
+procedure Walk(n : integer; acc : integer);
+var here : integer;
+
+   procedure Report;
+   begin
+      WriteLn('depth', n, acc, here)
+   end;
+
+begin
+   here := acc * 2;
+   begin if n > 0 then Walk(n - 1, here + n) else Report() end;
+   begin if n = 2 then Report() end
+end;
+
+begin
+   total := 0;
+   calls := 0;
+   Sum(30);
+   WriteLn(total, calls);
+   Walk(4, 1)
+end.
+""",
+    'folding': """\
+program Folding;
+var i : integer;
+var r : real;
+begin
+   i := 7;
+   WriteLn(7 DIV 2, 7 / 2, -7 DIV 2, 6 / 3, 10 * 4 DIV 2 + 3);
+   WriteLn(i DIV 2, i / 2, 1 + 2.5, 2 * 3 - 4 DIV 3, (1 + 2) * (3 - 5));
+   r := 10 DIV 4 + 10 / 4;
+   WriteLn(r, 1 < 2, 2 <= 1, 'a' = 'a', 'ab' + 'cd', -(3 - 5), +4)
+end.
+""",
+    'dead branches': """\
+program Branches;
+var x : integer;
+
+procedure P(n : integer);
+begin
+   begin if 1 = 1 then WriteLn('live', n) else WriteLn('dead', n) end;
+   begin if FALSE then WriteLn('dead') end;
+   begin begin ; x := x + n; end; ; end
+end;
+
+begin
+   x := 0;
+   begin if 2 > 1 then begin P(1); P(2) end else WriteLn('dead') end;
+   begin if 3 DIV 2 = 2 then WriteLn('dead') else begin if TRUE then P(3) end end;
+   begin if x > 3 then WriteLn('big', x) else WriteLn('small', x) end;
+   WriteLn(x)
+end.
+""",
+    'integer division by zero': """\
+program DivZero;
+var x : integer;
+begin
+   WriteLn('before');
+   x := 1 DIV 0;
+   WriteLn('after', x)
+end.
+""",
+    'real division by zero': """\
+program RealDivZero;
+begin
+   WriteLn('before', 1 / 2);
+   WriteLn(1 / (2 - 2))
+end.
+""",
+    'runaway recursion': """\
+program Runaway;
+procedure P;
+begin P() end;
+begin
+   WriteLn('before');
+   P()
+end.
+""",
+    'assignment to a procedure': """\
+program AssignProc;
+procedure Alpha;
+begin end;
+begin Alpha := 1 end.
+""",
+}
+
+# what every engine prints for ENGINE_PROGRAMS, and the error it ends with
+ENGINE_RESULTS = {
+    'static links': ("""\
+inner 1100 32 1 10 11 1 
+inner 1200 55 1 10 12 2 
+middle 56 55 
+inner 11300 338 1 112 113 3 
+inner 11400 565 1 112 114 4 
+middle 677 565 
+outer 677 4 
+inner 2100 63 2 20 21 5 
+inner 2200 107 2 20 22 6 
+middle 109 107 
+inner 21900 657 2 218 219 7 
+inner 22000 1097 2 218 220 8 
+middle 1315 1097 
+outer 1315 8 
+main 8 
+""", None),
+    'recursion': ("""\
+465 31 
+depth 0 65 130 
+depth 2 15 30 
+""", None),
+    'folding': ("""\
+3 3.5 -4 2.0 23 
+3 3.5 3.5 5 -6 
+4.5 True False True abcd 2 4 
+""", None),
+    'dead branches': ("""\
+live 1 
+live 2 
+live 3 
+big 6 
+6 
+""", None),
+    'integer division by zero': ('before \n', ZeroDivisionError),
+    'real division by zero': ('before 0.5 \n', ZeroDivisionError),
+    'runaway recursion': ('before \n', RecursionError),
+    'assignment to a procedure': ('', SemanticError),
+}
+
+# every engine with and without constant folding
+ENGINE_OPTIONS = [
+    [f'--engine={engine}', *variant]
+    for engine in ('ast', 'vm', 'closure', 'python')
+    for variant in ([], ['--no-opt'])
+]
+
+
+def dump(node):
+    """The shape of a tree with token positions, comparable with ==."""
+    fields = []
+    for name in spi._slot_names(type(node)):
+        value = getattr(node, name, None)
+        if isinstance(value, AST):
+            value = dump(value)
+        elif isinstance(value, list):
+            value = [dump(item) if isinstance(item, AST) else item for item in value]
+        elif isinstance(value, Token):
+            value = (value.type, value.value, value.lineno, value.column)
+        elif isinstance(value, Symbol):
+            value = (type(value).__name__, value.name)
+        fields.append((name, value))
+    return type(node).__name__, fields
+
+
+def checked_tree(text):
+    """What a fresh run of the front end makes of text."""
+    tree = Parser(Lexer(text)).parse()
+    SemanticAnalyzer().visit(tree)
+    return tree
+
+
+def outcome(parse):
+    """(tree, None) or (None, the error) of a parse."""
+    try:
+        return parse(), None
+    except (LexerError, ParserError, SemanticError) as e:
+        return None, (type(e).__name__, e.message)
+
+
+class ParserBacktrackingTest(unittest.TestCase):
+
+    def parser(self, text):
+        return Parser(TokenArray.from_lexer(Lexer(text)).cursor())
+
+    def advance_to(self, parser, token_type):
+        while parser.current_token.type != token_type:
+            parser.eat(parser.current_token.type)
+
+    def values(self, parser, count):
+        return [parser.peek(k).value for k in range(count)]
+
+    def test_mark_and_reset_mid_stream(self):
+        parser = self.parser('program P; var x : integer; begin x := 1 end.')
+        self.advance_to(parser, TokenType.VAR)
+        mark = parser.mark()
+        expected = self.values(parser, 4)
+        self.assertEqual(expected, ['VAR', 'x', ':', 'INTEGER'])
+        self.advance_to(parser, TokenType.ASSIGN)
+        parser.reset(mark)
+        self.assertEqual(self.values(parser, 4), expected)
+
+    def test_mark_and_reset_at_eof(self):
+        parser = self.parser('program P; begin end.')
+        self.advance_to(parser, TokenType.DOT)
+        mark = parser.mark()
+        parser.eat(TokenType.DOT)
+        parser.reset(mark)
+        self.assertEqual(parser.current_token.type, TokenType.DOT)
+        self.assertEqual(parser.next_token.type, TokenType.EOF)
+
+    def test_reset_from_eof_to_the_start(self):
+        parser = self.parser('program P; begin end.')
+        mark = parser.mark()
+        self.assertEqual(mark, 0)
+        self.advance_to(parser, TokenType.EOF)
+        parser.reset(mark)
+        self.assertEqual(self.values(parser, 3), ['PROGRAM', 'P', ';'])
+
+    def test_two_tokens(self):
+        tokens = TokenArray()
+        tokens.append(Token(TokenType.DOT, '.', 1, 1))
+        tokens.append(Token(TokenType.EOF, None))
+        parser = Parser(tokens.cursor())
+        self.assertEqual(parser.mark(), 0)
+        parser.eat(TokenType.DOT)
+        parser.reset(0)
+        self.assertEqual(parser.current_token.type, TokenType.DOT)
+
+    def test_peek(self):
+        parser = self.parser('program P; begin end.')
+        self.assertEqual(self.values(parser, 4), ['PROGRAM', 'P', ';', 'BEGIN'])
+        self.advance_to(parser, TokenType.END)
+        types = [parser.peek(k).type for k in range(5)]
+        self.assertEqual(types, [TokenType.END, TokenType.DOT] + [TokenType.EOF] * 3)
+
+
+class IncrementalParserTest(unittest.TestCase):
+
+    def assert_edit(self, parser, start, end, text):
+        """Apply an edit and compare the result with a fresh parse."""
+        tree, error = outcome(lambda: parser.edit(start, end, text))
+        expected, expected_error = outcome(lambda: checked_tree(parser.text))
+        context = f'{parser.text[max(0, start - 20):start + 20]!r} <- {text!r}'
+        self.assertEqual(error, expected_error, context)
+        if tree is not None:
+            parser.update_positions()
+            self.assertEqual(dump(tree), dump(expected), context)
+        return tree is not None
+
+    def fresh_parser(self):
+        parser = IncrementalParser(PROGRAM)
+        parser.parse()
+        return parser
+
+    def test_initial_parse(self):
+        parser = self.fresh_parser()
+        self.assertEqual(dump(parser.tree), dump(checked_tree(PROGRAM)))
+
+    def test_boundary_edits(self):
+        def at(pattern, group=0):
+            match = re.search(pattern, PROGRAM)
+            return match.start(group), match.end(group)
+
+        alpha_begin = at(r'\nbegin\n   x := \(a')[0] + 1
+        main_begin = at(r'begin \{ Main \}')[0]
+        edits = [
+            # inside tokens
+            (*at(r'a \* (10)', 1), '12'),
+            (*at(r'3\.(14)', 1), '5'),
+            (*at(r'Coun(t)\(3\)', 1), ''),
+            (*at(r'y := (x) - 1', 1), 'xx'),
+            (*at(r'r := (1); x', 1), '100'),
+            (*at(r'x := (2); W', 1), '-2'),
+            (at(r'10 \* 4')[0] + 1, at(r'10 \* 4')[0] + 1, '\n'),
+            # across statement boundaries
+            (at(r' \* 2;\n   Beta')[0], at(r'Beta\(5')[0], ' + 1;\n   '),
+            (at(r'3;\n   r :=')[0], at(r'r :=')[1], '1; r :='),
+            (*at(r';\n   Count\(3\)'), ''),
+            (*at(r'y := x - 1;\n'), ''),
+            (at(r'Count\(3\);')[1], at(r'Count\(3\);')[1], '\n\n   y := 2;'),
+            # removing and adding begin/end
+            (alpha_begin, alpha_begin + len('begin'), ''),
+            (*at(r'   end;\n\nbegin'), ''),
+            (*at(r'begin if x = 23'), ''),
+            (main_begin, main_begin + len('begin'), ''),
+            (*at(r'end\.'), ''),
+            (*at(r'\n   begin\n      x := a'), '\n   begin begin\n      x := a'),
+            (at(r'\n   end;\n\nbegin')[1], at(r'\n   end;\n\nbegin')[1], ' end;'),
+            # at the ends of the text
+            (0, 0, '\n'),
+            (0, len('program'), 'programm'),
+            (len(PROGRAM), len(PROGRAM), '\n\n'),
+            (len(PROGRAM), len(PROGRAM), 'x'),
+            (len(PROGRAM) - 1, len(PROGRAM), ''),
+            (*at(r'\.  \{ Main \}\n'), ''),
+        ]
+        for start, end, text in edits:
+            with self.subTest(edit=(start, end, text)):
+                self.assert_edit(self.fresh_parser(), start, end, text)
+
+    def test_successive_edits_on_one_line(self):
+        # each edit moves the statements after it on the same line
+        parser = self.fresh_parser()
+        for old, new in [('r := 1', 'r := 100'), ('x := 2', 'x := 2 * 3'),
+                         ('WriteLn(x, r)', 'WriteLn(r, x)'),
+                         ('x := 2 * 3', 'x := 2'), ('r := 100', 'r := 1')]:
+            start = parser.text.index(old)
+            self.assertTrue(self.assert_edit(parser, start, start + len(old), new))
+        self.assertEqual(parser.full_parses, 1)
+
+    def test_random_edits(self):
+        rng = random.Random(18)
+        parser = self.fresh_parser()
+        good = parser.text
+        inserts = ['', ' ', '\n', '\n\n', '1', '7', 'a', 'x', ';', '(', ')',
+                   ' + 2', ' * y', 'begin ', ' end', ':=', 'x := 1;', 'DIV']
+        for _ in range(400):
+            text = parser.text
+            start = rng.randrange(len(text) + 1)
+            end = min(len(text), start + rng.choice([0, 0, 1, 2, 5, 12]))
+            # an unterminated comment or string makes Lexer read to EOF
+            # and error, or never stop, so braces and quotes stay put
+            if re.search(r"[{}']", text[start:end]):
+                continue
+            new = rng.choice(inserts)
+            if start == end and not new:
+                continue
+            if self.assert_edit(parser, start, end, new):
+                good = parser.text
+            elif rng.random() < 0.7:
+                # back to a text that parses, most of the time
+                self.assert_edit(parser, 0, len(parser.text), good)
+        self.assertGreater(parser.unit_parses, 50)
+
+
+def walk(node):
+    yield node
+    for child in iter_child_nodes(node):
+        yield from walk(child)
+
+
+def optimized_tree(text):
+    tree = checked_tree(text)
+    optimizer = Optimizer()
+    return optimizer.optimize(tree), optimizer
+
+
+class EngineTest(unittest.TestCase):
+
+    def run_program(self, text, options):
+        """The output of text run with options, and the error it ended with."""
+        args = argument_parser().parse_args(['--no-cache', *options])
+        output = OutputSink.capture()
+        try:
+            run_program(text, args, output)
+        except Exception as e:
+            return output.getvalue(), type(e)
+        return output.getvalue(), None
+
+    def test_engines_agree(self):
+        for name, text in ENGINE_PROGRAMS.items():
+            for options in ENGINE_OPTIONS:
+                with self.subTest(program=name, options=options):
+                    self.assertEqual(self.run_program(text, options), ENGINE_RESULTS[name])
+
+    def test_folding_keeps_div_and_float_div_apart(self):
+        tree, _ = optimized_tree(
+            'program F; var i : integer; var r : real;\n'
+            'begin i := 7 DIV 2; r := 7 / 2; r := 6 / 3 end.'
+        )
+        values = [statement.right for statement in tree.block.compound_statement.children]
+        self.assertTrue(all(isinstance(value, Num) for value in values))
+        self.assertEqual([(type(v.value), v.value) for v in values],
+                         [(int, 3), (float, 3.5), (float, 2.0)])
+
+    def test_division_by_zero_is_not_folded(self):
+        for name in ('integer division by zero', 'real division by zero'):
+            with self.subTest(program=name):
+                tree, _ = optimized_tree(ENGINE_PROGRAMS[name])
+                self.assertTrue(any(isinstance(node, BinOp) for node in walk(tree)))
+
+    def test_assignment_to_a_procedure_is_rejected(self):
+        _, error = outcome(lambda: checked_tree(ENGINE_PROGRAMS['assignment to a procedure']))
+        self.assertEqual(error, (
+            'SemanticError',
+            "SemanticError: Not a variable -> Token(TokenType.ID, 'Alpha', position=4:7)",
+        ))
+
+    def test_dead_branches_are_removed(self):
+        tree, optimizer = optimized_tree(ENGINE_PROGRAMS['dead branches'])
+        strings = {node.value for node in walk(tree) if isinstance(node, String)}
+        self.assertEqual(strings, {'live', 'big', 'small'})
+        self.assertGreater(optimizer.removed_nodes, 0)
+
+
+class FromFileTest(unittest.TestCase):
+
+    def write(self, text):
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.pas',
+                                         delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.unlink, f.name)
+        return f.name
+
+    def test_utf8(self):
+        path = self.write("program U; begin WriteLn('h\u00e9llo') end.")
+        with Lexer.from_file(path) as lexer:
+            values = [token.value for token in lexer]
+        self.assertIn('h\u00e9llo', values)
+
+    def test_file_is_closed_on_errors(self):
+        path = self.write('program P; begin x := ; end.\n' + 'begin end;\n' * 1000)
+        lexer = Lexer.from_file(path, chunk_size=16)
+        with self.assertRaises(ParserError):
+            with lexer:
+                Parser(lexer).parse()
+        self.assertTrue(lexer.stream.closed)
+
+
+
+class MainTest(unittest.TestCase):
+
+    write = FromFileTest.write
+
+    def run_main(self, text):
+        path = self.write(text)
+        stdout = io.StringIO()
+        argv = ['spi.py', '--no-cache', path]
+        with mock.patch('sys.argv', argv), redirect_stdout(stdout):
+            with self.assertRaises(SystemExit) as raised:
+                spi.main()
+        return raised.exception.code, stdout.getvalue()
+
+    def test_errors_of_the_program_are_printed(self):
+        status, printed = self.run_main(
+            'program P; begin WriteLn(1); WriteLn(1 DIV 0) end.'
+        )
+        self.assertEqual(status, 1)
+        self.assertEqual(printed, '1 \nZeroDivisionError: '
+                                  'integer division or modulo by zero\n')
+
+    def test_runaway_recursion_is_printed(self):
+        status, printed = self.run_main(
+            'program R; procedure P; begin P() end; begin P() end.'
+        )
+        self.assertEqual(status, 1)
+        self.assertEqual(printed,
+                         'RecursionError: maximum recursion depth exceeded\n')
+
+
+class CrashedResultTest(unittest.TestCase):
+    """A crash is reported with the keys of every other result."""
+
+    def assert_result_keys(self, result):
+        self.assertEqual(result['status'], 'crashed')
+        self.assertEqual(set(result), {'file', 'status', 'error', 'time', 'output'})
+        self.assertEqual(result['output'], '')
+        self.assertGreaterEqual(result['time'], 0)
+
+    def test_pool_worker_crash(self):
+        # forked workers inherit the patch
+        with mock.patch('spi.run_captured', lambda *args: os._exit(3)):
+            with spi_pool.ProgramPool(1) as pool:
+                result, = pool.run([('crash.pas', 'program C; begin end.')])
+        self.assert_result_keys(result)
+        self.assertEqual(result['error'], 'worker exited with code 3')
+
+    def test_client_on_a_dropped_connection(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        address = os.path.join(directory.name, 'spi.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(address)
+            server.listen()
+
+            def drop():
+                connection, _ = server.accept()
+                connection.recv(4096)
+                connection.close()
+            thread = threading.Thread(target=drop)
+            thread.start()
+            result = spi_client.run(address, 'program C; begin end.', 'crash.pas')
+            thread.join()
+        self.assert_result_keys(result)
+
+
+class ProfileTest(unittest.TestCase):
+
+    TEXT = """\
+program Prof;
+procedure Alpha;
+   procedure Helper;
+   begin WriteLn('alpha helper') end;
+begin Helper() end;
+procedure Beta;
+   procedure Helper;
+   begin WriteLn('beta helper', 1 DIV 0) end;
+begin Helper() end;
+begin Alpha(); Alpha(); Beta() end.
+"""
+
+    def test_profile_of_a_failing_program(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'profile.json')
+        args = argument_parser().parse_args(
+            ['--no-cache', '--profile', '--profile-output', path]
+        )
+        output = OutputSink.capture()
+        with self.assertRaises(ZeroDivisionError):
+            run_program(self.TEXT, args, output)
+        self.assertIn('PROFILE', output.getvalue())
+        with open(path) as f:
+            procedures = json.load(f)['procedures']
+        calls = {name: stats['calls'] for name, stats in procedures.items()}
+        self.assertEqual(calls, {
+            'Prof': 1, 'Alpha': 2, 'Alpha.Helper': 2, 'Beta': 1, 'Beta.Helper': 1,
+        })
+
+# set by unpickling a Planted object
+planted_calls = []
+
+
+def _planted_hook():
+    planted_calls.append(True)
+
+
+class Planted:
+    def __reduce__(self):
+        return _planted_hook, ()
+
+
+class SourceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.text = ENGINE_PROGRAMS['recursion']
+        del planted_calls[:]
+
+    def test_round_trip(self):
+        cache = SourceCache(self.directory, key=b'k' * 32)
+        cache.store_tree(self.text, 'objects', checked_tree(self.text))
+        tree = cache.load_tree(self.text, 'objects')
+        self.assertEqual(dump(tree), dump(checked_tree(self.text)))
+        self.assertTrue(gc.isenabled())
+
+    def test_planted_entries_are_not_unpickled(self):
+        cache = SourceCache(self.directory, key=b'k' * 32)
+        cache.store_tree(self.text, 'objects', checked_tree(self.text))
+        path = cache.path(self.text, cache._tree_suffix('objects'))
+        payload = pickle.dumps(Planted())
+        for entry in (payload, b'\0' * 32 + payload):
+            with open(path, 'wb') as f:
+                f.write(entry)
+            self.assertIsNone(cache.load_tree(self.text, 'objects'))
+        self.assertEqual(planted_calls, [])
+
+    def test_entries_of_another_key_are_misses(self):
+        SourceCache(self.directory, key=b'a' * 32).store_code(self.text, compile('', '', 'exec'))
+        self.assertIsNotNone(SourceCache(self.directory, key=b'a' * 32).load_code(self.text))
+        self.assertIsNone(SourceCache(self.directory, key=b'b' * 32).load_code(self.text))
+
+    def test_entries_of_another_spi_are_misses(self):
+        cache = SourceCache(self.directory, key=b'k' * 32)
+        cache.store_tree(self.text, 'objects', checked_tree(self.text))
+        with open(spi.__file__, 'rb') as f:
+            source = f.read()
+        self.assertEqual(spi._implementation_digest(),
+                         hashlib.sha256(source).hexdigest())
+        with mock.patch('spi._implementation', '0' * 64):
+            self.assertIsNone(cache.load_tree(self.text, 'objects'))
+        self.assertIsNotNone(cache.load_tree(self.text, 'objects'))
+
+    def test_user_key(self):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.directory}):
+            key = spi._user_cache_key()
+            self.assertEqual(len(key), 32)
+            self.assertEqual(spi._user_cache_key(), key)
+            path = os.path.join(self.directory, 'spi', 'cache-key')
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            # a key others can read is no secret
+            os.chmod(path, 0o644)
+            self.assertIsNone(spi._user_cache_key())
+            self.assertIsNone(SourceCache(self.directory).load_code(self.text))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,18 @@
 # source-to-source compiler
+import argparse
+import contextlib
+import os
+import sys
+
 from spi import (
     Lexer,
     Parser,
     NodeVisitor,
     BuiltinTypeSymbol,
     VarSymbol,
-    ProcedureSymbol
+    ProcedureSymbol,
+    Compound,
+    NoOp,
 )
 
 class ScopedSymbolTable(object):
@@ -21,7 +28,7 @@ class ScopedSymbolTable(object):
     
     def __str__(self):
         h1 = 'SCOPE (SCOPED SYMBOL TABLE)'
-        lines = ['\n', h1, '=', * len(h1)]
+        lines = ['\n', h1, '=' * len(h1)]
         for header_name, header_value in (
             ('Scope name', self.scope_name),
             ('Scope level', self.scope_level),
@@ -62,26 +69,75 @@ class ScopedSymbolTable(object):
         if self.enclosing_scope is not None:
             return self.enclosing_scope.lookup(name)
 
+class Emitter(object):
+    """Indentation-aware output of the compiler.
+
+    Text goes out once, in order, to a stream or to a list of parts
+    joined by getvalue(). Each line gets the indentation of the level
+    it is written at, blank lines included, so nested procedures are
+    never re-indented after the fact.
+    """
+    INDENT = '    '
+
+    def __init__(self, stream=None):
+        self._parts = None
+        if stream is None:
+            self._parts = []
+            self._write = self._parts.append
+        else:
+            self._write = stream.write
+        self.level = 0
+        self._line_start = True
+
+    @contextlib.contextmanager
+    def indented(self):
+        self.level += 1
+        try:
+            yield
+        finally:
+            self.level -= 1
+
+    def write(self, text):
+        write = self._write
+        for i, line in enumerate(text.split('\n')):
+            if i:
+                if self._line_start and self.level:
+                    write(self.INDENT * self.level)
+                write('\n')
+                self._line_start = True
+            if line:
+                if self._line_start and self.level:
+                    write(self.INDENT * self.level)
+                write(line)
+                self._line_start = False
+
+    def getvalue(self):
+        return ''.join(self._parts)
+
+
 class SourceToSourceCompiler(NodeVisitor):
-    def __init__(self):
+    """Translate a program into Pascal with every name subscripted by its
+    scope level. The output is written to stream as it is produced, or
+    kept in self.output when no stream is given."""
+    def __init__(self, stream=None):
         self.current_scope = None
+        self.stream = stream
+        self.emitter = None
         self.output = None
-    
+
     def visit_Block(self, node):
-        results = []
+        emitter = self.emitter
         for declaration in node.declarations:
-            result = self.visit(declaration)
-            results.append(result)
-        results.append('\nbegin')
-        result = self.visit(node.compound_statement)
-        result = '   ' + result
-        results.append(result)
-        results.append('end')
-        return '\n'.join(results)
-    
+            self.visit(declaration)
+            emitter.write('\n')
+        emitter.write('\nbegin\n   ')
+        self.visit(node.compound_statement)
+        emitter.write('\nend')
+
     def visit_Program(self, node):
         program_name = node.name
-        result_str = 'program %s0;\n' % program_name
+        self.emitter = emitter = Emitter(self.stream)
+        emitter.write('program %s0;\n' % program_name)
 
         global_scope = ScopedSymbolTable(
             scope_name='global',
@@ -92,22 +148,28 @@ class SourceToSourceCompiler(NodeVisitor):
         self.current_scope = global_scope
 
         # visit subtree
-        result_str += self.visit(node.block)
-        result_str += '.'
-        result_str += ' {END OF %s}' % program_name
-        self.output = result_str
+        self.visit(node.block)
+        emitter.write('.')
+        emitter.write(' {END OF %s}' % program_name)
+        if self.stream is None:
+            self.output = emitter.getvalue()
 
         self.current_scope = global_scope.enclosing_scope
-    
+
     def visit_Compound(self, node):
-        results = []
+        # statements on separate lines, empty ones take no line
+        first = True
         for child in node.children:
-            result = self.visit(child)
-            if result is None:
+            if isinstance(child, NoOp):
                 continue
-            results.append(result)
-        return '\n'.join(results)
-    
+            if not first:
+                self.emitter.write('\n')
+            first = False
+            if isinstance(child, Compound):
+                self.visit(child)
+            else:
+                self.emitter.write(self.visit(child))
+
     def visit_NoOp(self, node):
         pass
 
@@ -115,56 +177,49 @@ class SourceToSourceCompiler(NodeVisitor):
         t1 = self.visit(node.left)
         t2 = self.visit(node.right)
         return '%s %s %s' % (t1, node.op.value, t2)
-    
+
     def visit_ProcedureDecl(self, node):
         proc_name = node.name
         proc_symbol = ProcedureSymbol(proc_name)
         self.current_scope.insert(proc_symbol)
 
-        result_str = 'procedure %s%s' % (
-            proc_name, self.current_scope.scope_level
-        )
+        emitter = self.emitter
+        # the whole procedure is indented one level, nested ones more
+        with emitter.indented():
+            emitter.write('procedure %s%s' % (
+                proc_name, self.current_scope.scope_level
+            ))
 
-        # Scope for parameters and local variables
-        procedure_scope = ScopedSymbolTable(
-            scope_name=proc_name,
-            scope_level=self.current_scope.scope_level+1,
-            enclosing_scope=self.current_scope
-        )
-        self.current_scope = procedure_scope
-
-        if node.params:
-            result_str += '('
-
-        formal_params = []
-        # Insert parameters into the procedure scope
-        for param in node.params:
-            param_type = self.current_scope.lookup(param.type_node.value)
-            param_name = param.var_node.value
-            var_symbol = VarSymbol(param_name, param_type)
-            self.current_scope.insert(var_symbol)
-            proc_symbol.params.append(var_symbol)
-            scope_level = str(self.current_scope.scope_level)
-            formal_params.append(
-                '%s : %s' % (param_name + scope_level, param_type.name)
+            # Scope for parameters and local variables
+            procedure_scope = ScopedSymbolTable(
+                scope_name=proc_name,
+                scope_level=self.current_scope.scope_level+1,
+                enclosing_scope=self.current_scope
             )
-        
-        result_str += '; '.join(formal_params)
-        if node.params:
-            result_str += ')'
-        result_str += ';'
-        result_str += '\n'
+            self.current_scope = procedure_scope
 
-        result_str += self.visit(node.block)
-        result_str += '; {END OF %s}' % proc_name
+            formal_params = []
+            # Insert parameters into the procedure scope
+            for param in node.params:
+                param_type = self.current_scope.lookup(param.type_node.value)
+                param_name = param.var_node.value
+                var_symbol = VarSymbol(param_name, param_type)
+                self.current_scope.insert(var_symbol)
+                proc_symbol.params.append(var_symbol)
+                scope_level = str(self.current_scope.scope_level)
+                formal_params.append(
+                    '%s : %s' % (param_name + scope_level, param_type.name)
+                )
 
-        # indent procedure test
-        result_str = '\n'.join('    ' + line for line in result_str.splitlines())
+            if node.params:
+                emitter.write('(%s)' % '; '.join(formal_params))
+            emitter.write(';\n')
+
+            self.visit(node.block)
+            emitter.write('; {END OF %s}' % proc_name)
 
         self.current_scope = self.current_scope.enclosing_scope
 
-        return result_str
-    
     def visit_VarDecl(self, node):
         type_name = node.type_node.value
         type_symbol = self.current_scope.lookup(type_name)
@@ -180,16 +235,16 @@ class SourceToSourceCompiler(NodeVisitor):
             raise Exception(
                 "Error: Duplicate identifier '%s' found" % var_name
             )
-        
+
         self.current_scope.insert(var_symbol)
         scope_level = str(self.current_scope.scope_level)
-        return '    var %s : %s;' % (var_name + scope_level, type_name)
+        self.emitter.write('    var %s : %s;' % (var_name + scope_level, type_name))
 
     def visit_Assign(self, node):
         t2 = self.visit(node.right)
         t1 = self.visit(node.left)
         return '%s %s %s;' % (t1, ':=', t2)
-    
+
     def visit_Var(self, node):
         var_name = node.value
         var_symbol = self.current_scope.lookup(var_name)
@@ -200,8 +255,42 @@ class SourceToSourceCompiler(NodeVisitor):
         scope_level = str(var_symbol.scope.scope_level)
         return '<%s:%s>' % (var_name + scope_level, var_symbol.type.name)
 
+
+def write_translation(tree, path):
+    """Translate tree into the file at path.
+
+    The translation streams into a temporary file next to path, which
+    replaces path only once it is complete: a translation that fails
+    leaves neither a partial file nor a truncated older one behind.
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as f:
+            SourceToSourceCompiler(f).visit(tree)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
 if __name__ == '__main__':
-    text = """
+    argparser = argparse.ArgumentParser(
+        description='Pascal source-to-source compiler'
+    )
+    argparser.add_argument(
+        'inputfile',
+        nargs='?',
+        help='Pascal source file (translates a built-in example when omitted)',
+    )
+    argparser.add_argument(
+        '-o', '--output',
+        help='Write the translation to this file as it is produced',
+    )
+    args = argparser.parse_args()
+
+    if args.inputfile is None:
+        text = """
         program Main;
         var x, y : real;
         var z : integer;
@@ -220,10 +309,16 @@ if __name__ == '__main__':
         begin { Main }
         end.  { Main }    
     """
+    else:
+        with open(args.inputfile) as f:
+            text = f.read()
     lexer = Lexer(text)
     parser = Parser(lexer)
     tree = parser.parse()
 
-    source_compiler = SourceToSourceCompiler()
-    source_compiler.visit(tree)
-    print(source_compiler.output)
\ No newline at end of file
+    if args.output is None:
+        source_compiler = SourceToSourceCompiler(sys.stdout)
+        source_compiler.visit(tree)
+        print()
+    else:
+        write_translation(tree, args.output)
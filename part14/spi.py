@@ -499,10 +499,28 @@ class Parser:
         return tree
 
 class NodeVisitor:
+    # node class -> visit_* function, every subclass gets its own table
+    _dispatch_table = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch_table = {}
+
     def visit(self, node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
+        try:
+            visitor = self._dispatch_table[node.__class__]
+        except KeyError:
+            visitor = self._resolve_visitor(node.__class__)
+        return visitor(self, node)
+
+    @classmethod
+    def _resolve_visitor(cls, node_class):
+        # resolved through the class so subclass overrides are honoured
+        method_name = 'visit_' + node_class.__name__
+        visitor = getattr(cls, method_name, cls.generic_visit)
+        cls._dispatch_table[node_class] = visitor
+        return visitor
+
     def generic_visit(self, node):
         raise Exception('No visit_{} method'.format(type(node).__name__))
 
@@ -0,0 +1,110 @@
+""" Translate many Pascal files with the source-to-source compiler.
+
+    python translate.py [-j JOBS] [--suffix .s2s] FILE_OR_DIR...
+
+Every input foo.pas is translated to foo.s2s next to it. Directories are
+searched recursively for .pas files. Files are spread over a pool of worker
+processes, so the interpreter starts once for the whole batch instead of
+once per file.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from spi import Lexer, Parser
+from source_to_source_compiler import write_translation
+
+
+def find_sources(paths):
+    """Expand directories into the .pas files below them, sorted."""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                sources.extend(
+                    os.path.join(root, name)
+                    for name in sorted(files) if name.endswith('.pas')
+                )
+        else:
+            sources.append(path)
+    return sources
+
+
+def output_path(path, suffix):
+    return os.path.splitext(path)[0] + suffix
+
+
+def translate_file(path, suffix):
+    """Translate one file; return (path, source lines, error message)."""
+    try:
+        with open(path) as f:
+            text = f.read()
+        tree = Parser(Lexer(text)).parse()
+        write_translation(tree, output_path(path, suffix))
+    except Exception as e:
+        return path, 0, '%s: %s' % (type(e).__name__, e)
+    return path, text.count('\n') + 1, None
+
+
+def translate_all(sources, suffix, jobs):
+    """Yield translate_file results in input order."""
+    if jobs == 1:
+        for path in sources:
+            yield translate_file(path, suffix)
+        return
+    # a few files per task keeps the pipes busy without starving workers
+    chunksize = max(1, len(sources) // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(
+            translate_file, sources, [suffix] * len(sources),
+            chunksize=chunksize,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Translate Pascal files with the source-to-source compiler'
+    )
+    parser.add_argument(
+        'inputs', nargs='+', metavar='FILE_OR_DIR',
+        help='Pascal source files or directories containing them',
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='Number of worker processes (default: number of CPUs)',
+    )
+    parser.add_argument(
+        '--suffix', default='.s2s',
+        help='Extension of the translated files (default: .s2s)',
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    sources = find_sources(args.inputs)
+    start = time.perf_counter()
+    files = lines = failed = 0
+    for path, count, error in translate_all(sources, args.suffix, args.jobs):
+        if error is not None:
+            print('%s: %s' % (path, error), file=sys.stderr)
+            failed += 1
+            continue
+        files += 1
+        lines += count
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    print(
+        'translated %d files (%d lines) in %.2fs with %d workers: '
+        '%.1f files/s, %.0f lines/s'
+        % (files, lines, elapsed, args.jobs, files / elapsed, lines / elapsed)
+    )
+    if failed:
+        print('%d files failed' % failed)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 """SPI - Simple Pascal Interpreter. Part 19"""
 
 import argparse
+import contextlib
+import glob
+import io
+import json
 import sys
+import time
 from enum import Enum
 
 _SHOULD_LOG_SCOPE = False  # see '--scope' command line option
@@ -1212,11 +1217,77 @@ class Interpreter(NodeVisitor):
         return self.visit(tree)
 
 
+def run_program(text):
+    """Lex, parse, check and interpret one program.
+
+    Errors are raised, not reported: LexerError, ParserError,
+    SemanticError, or whatever the running program raises.
+    """
+    lexer = Lexer(text)
+    parser = Parser(lexer)
+    tree = parser.parse()
+
+    semantic_analyzer = SemanticAnalyzer()
+    semantic_analyzer.visit(tree)
+
+    interpreter = Interpreter(tree)
+    interpreter.interpret()
+
+
+def batch_sources(patterns):
+    """Yield the files named by --batch inputs, expanding glob patterns.
+
+    Without patterns, or with just '-', paths are read from stdin, one
+    per line.
+    """
+    if not patterns or patterns == ['-']:
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                yield line
+        return
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            yield from sorted(glob.glob(pattern, recursive=True))
+        else:
+            yield pattern
+
+
+def run_batch(sources):
+    """Run each source in a fresh interpreter, print a JSON line per run.
+
+    What a program prints (--scope and --stack output) is captured
+    separately for each program. Returns 1 if any program failed.
+    """
+    failed = False
+    for path in sources:
+        output = io.StringIO()
+        result = {'file': path}
+        start = time.perf_counter()
+        try:
+            with open(path, 'r') as f:
+                text = f.read()
+            with contextlib.redirect_stdout(output):
+                run_program(text)
+            result['status'] = 'ok'
+        except Exception as e:
+            failed = True
+            result['status'] = 'error'
+            result['error'] = (
+                e.message if isinstance(e, Error)
+                else f'{e.__class__.__name__}: {e}'
+            )
+        result['time'] = time.perf_counter() - start
+        result['output'] = output.getvalue()
+        print(json.dumps(result), flush=True)
+    return 1 if failed else 0
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='SPI - Simple Pascal Interpreter'
     )
-    parser.add_argument('inputfile', help='Pascal source file')
+    parser.add_argument('inputfile', nargs='*', help='Pascal source file')
     parser.add_argument(
         '--scope',
         help='Print scope information',
@@ -1227,63 +1298,31 @@ def main():
         help='Print call stack',
         action='store_true',
     )
+    parser.add_argument(
+        '--batch',
+        help='Run every input file (paths or glob patterns, read from stdin '
+             'one per line when none are given or the input is -) and print '
+             'one JSON line per program',
+        action='store_true',
+    )
     args = parser.parse_args()
 
     global _SHOULD_LOG_SCOPE, _SHOULD_LOG_STACK
     _SHOULD_LOG_SCOPE, _SHOULD_LOG_STACK = args.scope, args.stack
 
-    text = open(args.inputfile, 'r').read()
+    if args.batch:
+        sys.exit(run_batch(batch_sources(args.inputfile)))
+    if len(args.inputfile) != 1:
+        parser.error('exactly one input file is needed without --batch')
 
-    lexer = Lexer(text)
-    try:
-        parser = Parser(lexer)
-        tree = parser.parse()
-    except (LexerError, ParserError) as e:
-        print(e.message)
-        sys.exit(1)
+    text = open(args.inputfile[0], 'r').read()
 
-    semantic_analyzer = SemanticAnalyzer()
     try:
-        semantic_analyzer.visit(tree)
-    except SemanticError as e:
+        run_program(text)
+    except Error as e:
         print(e.message)
         sys.exit(1)
 
-    interpreter = Interpreter(tree)
-    interpreter.interpret()
 
-def main2():
-    text = """
-    PROGRAM Main;
-      procedure Alpha;
-        {procedure Beta;
-        begin
-          WriteLn('Hola Beta dentro de Alpha')
-        end;}
-      Begin
-        {Beta;}
-      End;
-    BEGIN
-      Alpha;      
-    END.
-    """
-    lexer = Lexer(text)
-    try:
-        parser = Parser(lexer)
-        tree = parser.parse()
-    except (LexerError, ParserError) as e:
-        print(e.message)
-        sys.exit(1)
-
-    semantic_analyzer = SemanticAnalyzer()
-    try:
-        semantic_analyzer.visit(tree)
-    except SemanticError as e:
-        print(e.message)
-        sys.exit(1)
-
-    interpreter = Interpreter(tree)
-    interpreter.interpret()
-        
 if __name__ == '__main__':
-    main2()
+    main()